@@ -20,7 +20,7 @@ from flask import Flask, render_template, request, jsonify, session, redirect, u
 from dotenv import load_dotenv
 
 # 从 common 导入
-from common.models import DeviceStatus, DeviceType, OperationType, EntrySource, CarMachine, Instrument, Phone, SimCard, OtherDevice, Record, UserRemark, User, Admin, Announcement, BountyStatus, PointsTransactionType
+from common.models import DeviceStatus, DeviceType, OperationType, EntrySource, Record, UserRemark, User, Admin, Announcement, BountyStatus, PointsTransactionType
 from common.api_client import api_client
 from common.db_store import DatabaseStore, init_database
 from common.utils import mask_phone, is_mobile_device
@@ -119,29 +119,6 @@ def admin_mobile_login():
     return render_template('admin/mobile/login.html')
 
 
-def get_device_type_str(device):
-    """获取设备类型字符串"""
-    # 方式1：通过实例类型判断
-    if isinstance(device, CarMachine):
-        return "车机"
-    elif isinstance(device, Instrument):
-        return "仪表"
-    elif isinstance(device, Phone):
-        return "手机"
-    elif isinstance(device, SimCard):
-        return "手机卡"
-    elif isinstance(device, OtherDevice):
-        return "其它设备"
-
-    # 方式2：通过 device_type 属性判断（当实例类型不匹配时）
-    if hasattr(device, 'device_type') and device.device_type:
-        if isinstance(device.device_type, DeviceType):
-            return device.device_type.value
-        return str(device.device_type)
-
-    return "未知"
-
-
 def get_device_type_value(device):
     """安全获取设备类型的值（字符串）"""
     if hasattr(device, 'device_type') and device.device_type:
@@ -780,7 +757,7 @@ def api_overdue_export():
                         overdue_hours = int(time_diff.total_seconds() // 3600)
 
                         # 获取设备类型
-                        device_type = get_device_type_str(device)
+                        device_type = device.device_type_label
 
                         overdue_devices.append({
                             '设备名称': device.name,
@@ -1446,7 +1423,7 @@ def api_devices():
         devices_data = []
         for device in devices:
             # 获取设备类型字符串
-            device_type_str = get_device_type_str(device)
+            device_type_str = device.device_type_label
             
             # 判断是否为使用保管人的设备类型
             is_custodian_type = device.device_type in [DeviceType.PHONE, DeviceType.SIM_CARD, DeviceType.OTHER_DEVICE]
@@ -1861,7 +1838,7 @@ def api_admin_return(device_id):
         id=str(uuid.uuid4()),
         device_id=device.id,
         device_name=device.name,
-        device_type=get_device_type_str(device),
+        device_type=device.device_type_label,
         operation_type=OperationType.FORCE_RETURN,
         operator=session.get('admin_name', '管理员'),
         operation_time=datetime.now(),
@@ -1956,7 +1933,7 @@ def api_admin_transfer(device_id):
         id=str(uuid.uuid4()),
         device_id=device.id,
         device_name=device.name,
-        device_type=get_device_type_str(device),
+        device_type=device.device_type_label,
         operation_type=OperationType.TRANSFER,
         operator=session.get('admin_name', '管理员'),
         operation_time=datetime.now(),
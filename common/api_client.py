@@ -5,7 +5,13 @@
 """
 import uuid
 import os
+import time
+import secrets
+import itertools
+import queue
+import atexit
 import threading
+from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict, Any
@@ -24,6 +30,17 @@ email_executor = ThreadPoolExecutor(max_workers=_email_max_workers, thread_name_
 # 创建全局 DatabaseStore 实例
 _db_store = DatabaseStore()
 
+# 设备锁分段数量：按设备ID散列到固定数量的锁上，不同设备的修改互不阻塞
+_DEVICE_LOCK_STRIPES = 64
+
+# 操作日志异步批量写入配置：每批最多100条，或最多等待50毫秒
+_OPLOG_BATCH_SIZE = 100
+_OPLOG_FLUSH_INTERVAL = 0.05
+
+
+class DeviceDeletedError(Exception):
+    """设备在修改过程中已被删除（如管理端同时删除了该设备）"""
+
 
 class APIClient:
     """API 客户端单例类"""
@@ -50,8 +67,36 @@ class APIClient:
         if not APIClient._initialized:
             self._current_admin = "管理员"
             self._db = _db_store
+            # 设备读-改-写互斥锁（可重入，按设备ID分段），替代每次请求的全量 reload_data
+            self._device_locks = [threading.RLock() for _ in range(_DEVICE_LOCK_STRIPES)]
+            # 操作日志写入队列，由后台线程批量落库，不阻塞请求
+            self._oplog_queue = queue.Queue()
+            self._oplog_thread = None
+            self._oplog_thread_lock = threading.Lock()
+            atexit.register(self.flush_operation_logs)
+            self._reset_id_generator()
+            if hasattr(os, 'register_at_fork'):
+                # fork 出的子进程使用新的前缀，避免与父进程生成相同的ID
+                os.register_at_fork(after_in_child=self._reset_id_generator)
             APIClient._initialized = True
 
+    def device_lock(self, device_id: str) -> threading.RLock:
+        """获取指定设备的读-改-写锁（同一设备的修改串行执行，不同设备之间一般不会互相等待）"""
+        return self._device_locks[hash(device_id) % _DEVICE_LOCK_STRIPES]
+
+    def _reset_id_generator(self):
+        """初始化记录ID生成器：随机前缀 + 以毫秒时间戳起始的自增序号"""
+        self._id_prefix = secrets.token_hex(4)
+        self._id_seq = itertools.count(int(time.time() * 1000) << 20)
+
+    def new_id(self) -> str:
+        """生成新的内部记录ID（用于借还记录、操作日志等，不必每次读取系统随机数并格式化UUID）
+
+        ID 可按顺序推测，不能用于会出现在URL或请求参数中、按ID直接操作的对象
+        （预约、通知、公告、备注、悬赏、背包物品），这些对象仍使用 uuid4
+        """
+        return f"{self._id_prefix}{next(self._id_seq):x}"
+
     def _should_update_rankings_cache(self) -> bool:
         """检查是否需要更新排行榜缓存（每天0点后更新）"""
         if self._rankings_cache['last_update'] is None:
@@ -260,20 +305,6 @@ class APIClient:
         except OSError:
             pass
 
-    def _get_device_type_str(self, device: Device) -> str:
-        """获取设备类型字符串"""
-        if isinstance(device, CarMachine):
-            return "车机"
-        elif isinstance(device, Instrument):
-            return "仪表"
-        elif isinstance(device, Phone):
-            return "手机"
-        elif isinstance(device, SimCard):
-            return "手机卡"
-        elif isinstance(device, OtherDevice):
-            return "其它设备"
-        return device.device_type.value if hasattr(device, 'device_type') else "未知"
-
     def _get_default_status_for_device(self, device) -> DeviceStatus:
         """根据设备类型获取默认状态（在库/保管中）"""
         if device.device_type in [DeviceType.PHONE, DeviceType.SIM_CARD, DeviceType.OTHER_DEVICE]:
@@ -305,16 +336,16 @@ class APIClient:
         
         return False
     
+    def get_admin_names(self) -> frozenset:
+        """获取所有管理员名称集合（含后台登录的特殊管理员用户名）"""
+        return frozenset(['管理员', 'admin', *self._db.get_admin_borrower_names()])
+
     def is_user_admin(self, borrower_name: str) -> bool:
         """检查指定用户是否为管理员"""
         # 特殊管理员用户名（后台登录的管理员）
         if borrower_name in ['管理员', 'admin']:
             return True
-        # 检查用户是否为管理员
-        for user in self._db.get_all_users():
-            if user.borrower_name == borrower_name and user.is_admin:
-                return True
-        return False
+        return borrower_name in self.get_admin_names()
     
     def set_current_admin(self, admin_name: str):
         """设置当前管理员"""
@@ -343,10 +374,7 @@ class APIClient:
 
     def get_user_by_borrower_name(self, borrower_name: str) -> Optional[User]:
         """根据借用人名称获取用户"""
-        for user in self._db.get_all_users():
-            if user.borrower_name == borrower_name:
-                return user
-        return None
+        return self._db.get_user_by_borrower_name(borrower_name)
 
     def update_user_borrower_name(self, user_id: str, borrower_name: str) -> bool:
         """更新用户借用人名称"""
@@ -359,6 +387,7 @@ class APIClient:
         if user:
             user.borrower_name = borrower_name
             self._db.save_user(user)
+            self._invalidate_users_cache()
             return True
         return False
     
@@ -391,6 +420,7 @@ class APIClient:
         )
         
         self._db.save_user(new_user)
+        self._invalidate_users_cache()
         return True, "注册成功"
     
     # ==================== 设备管理 ====================
@@ -401,25 +431,27 @@ class APIClient:
         # 按创建时间倒序排列，最新的设备排在最前面
         return sorted(devices, key=lambda d: d.create_time if d.create_time else datetime.min, reverse=True)
     
-    def get_device_by_id(self, device_id: str) -> Optional[Device]:
-        """根据ID获取设备"""
-        return self._db.get_device_by_id(device_id)
+    def search_devices(self, keyword: str, fields: Optional[tuple] = None, limit: Optional[int] = None) -> List[Device]:
+        """按关键词搜索设备（大小写不敏感），按创建时间倒序排列"""
+        return self._db.search_devices(keyword, fields=fields, limit=limit)
+
+    def count_borrowed_devices(self, borrower: str) -> int:
+        """获取指定借用人当前借出中的设备数量"""
+        return self._db.count_borrowed_devices(borrower)
+
+    def get_device_by_id(self, device_id: str, device_type: Optional[str] = None) -> Optional[Device]:
+        """根据ID获取设备，指定 device_type 时只在该类型中查找"""
+        return self._db.get_device_by_id(device_id, device_type=device_type)
     
     def get_device_by_name(self, device_name: str) -> Optional[Device]:
         """根据名称获取设备"""
-        all_devices = self._db.get_all_devices()
-        for device in all_devices:
-            if device.name == device_name:
-                return device
-        return None
+        return self._db.get_device_by_name(device_name)
     
     def add_device(self, device: Device) -> bool:
         """新增设备"""
         # 检查设备名是否唯一
-        all_devices = self._db.get_all_devices()
-        for d in all_devices:
-            if d.name == device.name:
-                return False
+        if self._db.get_device_by_name(device.name):
+            return False
 
         self._db.save_device(device)
 
@@ -456,12 +488,59 @@ class APIClient:
             return True
         return False
 
+    @contextmanager
+    def device_txn(self, device: Device, source: str = "admin"):
+        """批量修改设备字段
+
+        with 块内只修改内存中的设备对象，正常退出时统一写库、使缓存失效并记录一次操作日志；
+        块内抛出异常则不写库。写库时只更新仍未删除的设备，设备已被删除则抛出 DeviceDeletedError
+
+        Args:
+            device: 设备对象
+            source: 操作来源，admin-管理员操作，user-用户端操作
+        """
+        yield device
+        if not self._db.update_live_device(device):
+            raise DeviceDeletedError(device.id)
+
+        # 使设备缓存失效
+        try:
+            from .cache_manager import data_cache
+            data_cache.invalidate_device_cache(device.id)
+        except Exception:
+            pass
+
+        self.add_operation_log("更新设备信息", device.name, source=source)
+
+    def update_device_fields(self, device: Device, fields: tuple, source: str = "admin") -> bool:
+        """仅更新设备的指定字段
+
+        Args:
+            device: 设备对象（字段值已在内存中修改）
+            fields: 需要写入数据库的字段名
+            source: 操作来源，admin-管理员操作，user-用户端操作
+
+        设备已被删除（如管理端同时删除了该设备）时不写入，抛出 DeviceDeletedError
+        """
+        if not self._db.update_device_fields(device, fields):
+            raise DeviceDeletedError(device.id)
+
+        # 使设备缓存失效
+        try:
+            from .cache_manager import data_cache
+            data_cache.invalidate_device_cache(device.id)
+        except Exception:
+            pass
+
+        self.add_operation_log("更新设备信息", device.name, source=source)
+        return True
+
     def delete_device(self, device_id: str) -> bool:
         """软删除设备"""
         device = self._db.get_device_by_id(device_id)
         if device:
             # 取消所有有效预约
-            device_type = self._get_device_type_str(device)
+            device_type = device.device_type_label
             self._cancel_reservations_on_device_delete(device_id, device_type, device.name)
 
             device.is_deleted = True
@@ -545,10 +624,10 @@ class APIClient:
         
         # 添加记录
         record = Record(
-            id=str(uuid.uuid4()),
+            id=self.new_id(),
             device_id=device.id,
             device_name=device.name,
-            device_type=self._get_device_type_str(device),
+            device_type=device.device_type_label,
             operation_type=OperationType.FORCE_BORROW,
             operator=self._current_admin,
             operation_time=datetime.now(),
@@ -596,10 +675,10 @@ class APIClient:
         
         # 添加记录
         record = Record(
-            id=str(uuid.uuid4()),
+            id=self.new_id(),
             device_id=device.id,
             device_name=device.name,
-            device_type=self._get_device_type_str(device),
+            device_type=device.device_type_label,
             operation_type=OperationType.FORCE_RETURN,
             operator=self._current_admin,
             operation_time=datetime.now(),
@@ -653,10 +732,10 @@ class APIClient:
         
         # 添加记录
         record = Record(
-            id=str(uuid.uuid4()),
+            id=self.new_id(),
             device_id=device.id,
             device_name=device.name,
-            device_type=self._get_device_type_str(device),
+            device_type=device.device_type_label,
             operation_type=OperationType.TRANSFER,
             operator=self._current_admin,
             operation_time=datetime.now(),
@@ -720,11 +799,36 @@ class APIClient:
         
         return sorted(records, key=lambda x: x.operation_time, reverse=True)
     
+    def get_records_by_borrower(self, borrower: str) -> List[Record]:
+        """获取借用人为指定用户的记录（按时间倒序）"""
+        return self._db.get_records_by_borrower(borrower)
+
+    def get_records_paginated(self, page: int = 1, per_page: int = 20, borrower_name: str = None) -> Dict[str, Any]:
+        """获取分页记录列表（在数据库层分页）"""
+        return self._db.get_records_paginated(page=page, per_page=per_page, borrower_name=borrower_name)
+
+    def count_records_by_operation_type(self) -> Dict[str, int]:
+        """按操作类型统计记录数量"""
+        return self._db.count_records_by_operation_type()
+
     # ==================== 人员管理 ====================
     
     def get_all_users(self) -> List[User]:
         """获取所有用户"""
         return self._db.get_all_users()
+
+    def get_active_users_payload(self) -> bytes:
+        """获取可选用户列表的JSON响应体（转借/转让联想使用，带缓存）"""
+        from .cache_manager import data_cache
+        return data_cache.get_cached_active_users_payload()
+
+    def _invalidate_users_cache(self):
+        """用户新增、改名、冻结、删除后使用户缓存失效"""
+        try:
+            from .cache_manager import data_cache
+            data_cache.invalidate_users_cache()
+        except Exception:
+            pass
     
     def freeze_user(self, user_id: str) -> bool:
         """冻结用户"""
@@ -732,6 +836,7 @@ class APIClient:
         if user:
             user.is_frozen = True
             self._db.save_user(user)
+            self._invalidate_users_cache()
             self.add_operation_log(f"冻结用户", user.borrower_name)
             return True
         return False
@@ -742,6 +847,7 @@ class APIClient:
         if user:
             user.is_frozen = False
             self._db.save_user(user)
+            self._invalidate_users_cache()
             self.add_operation_log(f"解冻用户", user.borrower_name)
             return True
         return False
@@ -968,12 +1074,8 @@ class APIClient:
                 custodian_changed = True
             # 根据保管人名称查找并更新custodian_id
             if device.cabinet_number:
-                for user in self._users:
-                    if user.borrower_name == device.cabinet_number:
-                        device.custodian_id = user.id
-                        break
-                else:
-                    device.custodian_id = ""
+                custodian_user = self._db.get_user_by_borrower_name(device.cabinet_number)
+                device.custodian_id = custodian_user.id if custodian_user else ""
             else:
                 device.custodian_id = ""
         if 'status' in data:
@@ -1040,10 +1142,10 @@ class APIClient:
         if status_changed and not is_scrapped:
             notify_user = device.borrower or original_borrower or device.cabinet_number or original_custodian
             record = Record(
-                id=str(uuid.uuid4()),
+                id=self.new_id(),
                 device_id=device.id,
                 device_name=device.name,
-                device_type=self._get_device_type_str(device),
+                device_type=device.device_type_label,
                 operation_type=OperationType.STATUS_CHANGE,
                 operator=operator,
                 operation_time=datetime.now(),
@@ -1056,10 +1158,10 @@ class APIClient:
         # 添加保管人变更记录
         if custodian_changed:
             record = Record(
-                id=str(uuid.uuid4()),
+                id=self.new_id(),
                 device_id=device.id,
                 device_name=device.name,
-                device_type=self._get_device_type_str(device),
+                device_type=device.device_type_label,
                 operation_type=OperationType.CUSTODIAN_CHANGE,
                 operator=operator,
                 operation_time=datetime.now(),
@@ -1079,10 +1181,10 @@ class APIClient:
             device.reason = ''
 
             record = Record(
-                id=str(uuid.uuid4()),
+                id=self.new_id(),
                 device_id=device.id,
                 device_name=device.name,
-                device_type=self._get_device_type_str(device),
+                device_type=device.device_type_label,
                 operation_type=OperationType.SCRAP,
                 operator=operator,
                 operation_time=datetime.now(),
@@ -1192,6 +1294,7 @@ class APIClient:
             create_time=datetime.now()
         )
         self._db.save_user(user)
+        self._invalidate_users_cache()
         self.add_operation_log("创建用户", borrower_name)
         return user
     
@@ -1213,6 +1316,7 @@ class APIClient:
                 user.is_first_login = data['is_first_login']
             
             self._db.save_user(user)
+            self._invalidate_users_cache()
             
             # 如果借用人名称发生变化，同步更新设备表中的借用人和保管人
             if 'name' in data and old_borrower_name and old_borrower_name != data['name']:
@@ -1320,6 +1424,7 @@ class APIClient:
 
         user.is_deleted = True
         self._db.save_user(user)
+        self._invalidate_users_cache()
         self.add_operation_log("删除用户", user.borrower_name)
         return True, "删除成功"
     
@@ -1444,7 +1549,7 @@ class APIClient:
 
         # 创建记录
         record = Record(
-            id=str(uuid.uuid4()),
+            id=self.new_id(),
             device_id=device_id,
             device_name=device.name,
             device_type=device.device_type.value,
@@ -1491,7 +1596,7 @@ class APIClient:
 
         # 创建记录
         record = Record(
-            id=str(uuid.uuid4()),
+            id=self.new_id(),
             device_id=device_id,
             device_name=device.name,
             device_type=device.device_type.value,
@@ -1541,10 +1646,13 @@ class APIClient:
             remarks = [r for r in remarks if not r.is_inappropriate]
         return remarks
     
+    def get_remark_by_id(self, remark_id: str) -> Optional[UserRemark]:
+        """根据ID获取备注"""
+        return self._db.get_remark_by_id(remark_id)
+
     def delete_remark(self, remark_id: str) -> bool:
         """删除备注"""
-        self._db.delete_remark(remark_id)
-        return True
+        return self._db.delete_remark(remark_id)
 
     def mark_inappropriate(self, remark_id: str) -> bool:
         """标记不当备注"""
@@ -1571,18 +1679,68 @@ class APIClient:
             source: 操作来源，admin-管理员操作，user-用户端操作
         """
         log = OperationLog(
-            id=str(uuid.uuid4()),
+            id=self.new_id(),
             operation_time=datetime.now(),
             operator=operator if operator else self._current_admin,
             operation_content=operation_content,
             device_info=device_info,
             source=source
         )
-        self._db.save_operation_log(log)
+        self._ensure_oplog_thread()
+        self._oplog_queue.put(log)
+
+    def _ensure_oplog_thread(self):
+        """按需启动日志写入线程（fork 出的子进程中会重新启动）"""
+        if self._oplog_thread is not None and self._oplog_thread.is_alive():
+            return
+        with self._oplog_thread_lock:
+            if self._oplog_thread is None or not self._oplog_thread.is_alive():
+                self._oplog_thread = threading.Thread(
+                    target=self._oplog_worker, name="oplog_writer", daemon=True
+                )
+                self._oplog_thread.start()
+
+    def _oplog_worker(self):
+        """后台线程：从队列中取出操作日志并批量写入数据库"""
+        while True:
+            batch = [self._oplog_queue.get()]
+            deadline = time.monotonic() + _OPLOG_FLUSH_INTERVAL
+            while len(batch) < _OPLOG_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._oplog_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._save_operation_log_batch(batch)
+            finally:
+                for _ in batch:
+                    self._oplog_queue.task_done()
+
+    def _save_operation_log_batch(self, batch: List[OperationLog]):
+        """批量写入操作日志；整批失败（事务已回滚）时逐条重试，只丢弃确实写不进去的日志"""
+        try:
+            self._db.save_operation_logs(batch)
+            return
+        except Exception as e:
+            self._safe_print(f"⚠ 操作日志批量写入失败，改为逐条写入: {e}")
+        for log in batch:
+            try:
+                self._db.save_operation_log(log)
+            except Exception as e:
+                self._safe_print(f"⚠ 操作日志写入失败: {log.operation_content} {log.device_info}: {e}")
+
+    def flush_operation_logs(self):
+        """等待队列中的操作日志全部写入数据库（进程退出时调用）"""
+        if self._oplog_thread is not None and self._oplog_thread.is_alive():
+            self._oplog_queue.join()
     
     def get_admin_logs(self, limit: int = 100) -> List[dict]:
         """获取管理员操作日志（用于后台管理）"""
         logs = self.get_operation_logs(limit * 2)
+        admin_names = self.get_admin_names()
         result = []
         for log in logs:
             # 只显示管理员操作（source="admin"）
@@ -1590,7 +1748,7 @@ class APIClient:
             if log.source == "user":
                 continue
             # 对于 source="admin" 或旧数据（source=None），检查操作人是否为管理员
-            if not self.is_user_admin(log.operator):
+            if log.operator not in admin_names:
                 continue
             result.append({
                 'id': log.id,
@@ -1654,7 +1812,7 @@ class APIClient:
             error_message: 错误信息
         """
         log = AdminOperationLog(
-            id=str(uuid.uuid4()),
+            id=self.new_id(),
             operation_time=datetime.now(),
             admin_id=admin_id,
             admin_name=admin_name,
@@ -2185,7 +2343,7 @@ class APIClient:
             return False, "今天点赞次数已达上限（5次）"
         
         like = UserLike(
-            id=str(uuid.uuid4()),
+            id=self.new_id(),
             from_user_id=from_user_id,
             to_user_id=to_user_id,
             create_date=today,
@@ -2545,7 +2703,7 @@ class APIClient:
                 
                 # 创建续期记录
                 record = Record(
-                    id=str(uuid.uuid4()),
+                    id=self.new_id(),
                     device_id=device.id,
                     device_name=device.name,
                     device_type=device.device_type.value if hasattr(device.device_type, 'value') else str(device.device_type),
@@ -2600,7 +2758,7 @@ class APIClient:
         
         # 创建借还记录 - 修改借用人和原因显示
         record = Record(
-            id=str(uuid.uuid4()),
+            id=self.new_id(),
             device_id=device.id,
             device_name=device.name,
             device_type=device.device_type.value if hasattr(device.device_type, 'value') else str(device.device_type),
@@ -2765,11 +2923,7 @@ class APIClient:
         
         # 通知保管人（如果设备有保管人）
         if device and hasattr(device, 'custodian_id') and device.custodian_id:
-            custodian_user = None
-            for u in self._users:
-                if u.id == device.custodian_id:
-                    custodian_user = u
-                    break
+            custodian_user = self._db.get_user_by_id(device.custodian_id)
             if custodian_user and custodian_user.borrower_name != cancelled_by:
                 self.add_notification(
                     user_id=custodian_user.id,
@@ -3168,7 +3322,7 @@ class APIClient:
 
                 devices_data = [{
                     'name': device.name,
-                    'device_type': self._get_device_type_str(device),
+                    'device_type': device.device_type_label,
                     'overdue_days': overdue_days if overdue_days > 0 else 1
                 }]
 
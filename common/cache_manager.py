@@ -3,11 +3,19 @@
 缓存管理器
 提供内存缓存机制，避免频繁的数据库查询
 """
+import json
 import time
 import threading
 from typing import Any, Optional, Callable
 from functools import wraps
 
+# 尝试导入orjson（直接序列化为bytes），未安装时使用标准库json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 
 class CacheManager:
     """缓存管理器（单例模式）"""
@@ -144,6 +152,7 @@ class DataCache:
         'records': 60,       # 记录列表：1分钟（数据变化频繁）
         'statistics': 300,   # 统计数据：5分钟（计算成本高）
         'device_single': 120, # 单个设备：2分钟
+        'active_users': 30,  # 可选用户列表响应：30秒（其他服务冻结/删除用户时本进程无法感知，依赖过期刷新）
     }
 
     def __init__(self):
@@ -231,9 +240,37 @@ class DataCache:
 
         return users_data
 
+    def get_cached_active_users_payload(self, force_refresh: bool = False) -> bytes:
+        """
+        获取可选用户列表（已设置借用人名称且未冻结）的JSON响应体
+        缓存的是序列化后的bytes，命中时无需再遍历用户和编码
+        :param force_refresh: 强制刷新缓存
+        :return: {"success": true, "users": [...]} 的UTF-8编码
+        """
+        cache_key = "users:active_payload"
+
+        if not force_refresh:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        # 从数据库加载
+        from common.db_store import DatabaseStore
+        db = DatabaseStore()
+        payload = {'success': True, 'users': db.get_active_user_briefs()}
+        if ORJSON_AVAILABLE:
+            payload_bytes = orjson.dumps(payload)
+        else:
+            payload_bytes = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+        self.cache.set(cache_key, payload_bytes, ttl=self.CACHE_TTL['active_users'])
+
+        return payload_bytes
+
     def invalidate_users_cache(self):
         """使用户缓存失效"""
         self.cache.delete("users:all")
+        self.cache.delete("users:active_payload")
         self.cache.clear_pattern("users:page:")
         self._increment_version('users')
 
@@ -25,6 +25,10 @@ USER_SERVICE_PORT = 5000
 ADMIN_SERVICE_PORT = 5001
 MOBILE_SERVICE_PORT = 5002
 
+# 用户服务 WSGI 工作线程数（未设置或为 0 时按 CPU 核心数 * 4 计算，最多32）
+# 视图主要阻塞在 MySQL 查询上，线程数可以高于 CPU 核心数，但不应超过数据库连接池上限
+USER_SERVICE_THREADS = int(os.getenv('USER_SERVICE_THREADS', '0')) or min((os.cpu_count() or 4) * 4, 32)
+
 # 数据库配置（仅支持MySQL）
 MYSQL_HOST = os.getenv('MYSQL_HOST', 'localhost')
 MYSQL_PORT = int(os.getenv('MYSQL_PORT', '3306'))
@@ -5,6 +5,7 @@
 使用连接池优化性能
 """
 import os
+import re
 import threading
 import uuid
 from datetime import datetime
@@ -159,6 +160,40 @@ def escape_percent(val):
     return val
 
 
+# devices 表中可按字段增量更新的列（与 save_device 的 UPDATE 语句一致）
+_DEVICE_UPDATABLE_COLUMNS = (
+    'name', 'device_type', 'model', 'cabinet_number', 'status', 'remark', 'jira_address',
+    'borrower', 'borrower_id', 'custodian_id', 'phone', 'borrow_time', 'location', 'reason',
+    'entry_source', 'expected_return_date', 'admin_operator', 'ship_time', 'ship_remark', 'ship_by',
+    'pre_ship_borrower', 'pre_ship_borrow_time', 'pre_ship_expected_return_date', 'lost_time',
+    'damage_reason', 'damage_time', 'previous_borrower', 'previous_status', 'sn', 'system_version',
+    'imei', 'carrier', 'software_version', 'hardware_version', 'project_attribute',
+    'connection_method', 'os_version', 'os_platform', 'product_name', 'screen_orientation',
+    'screen_resolution', 'asset_number', 'purchase_amount', 'is_deleted'
+)
+# device_txn 整体写回设备时更新的字段（不含 is_deleted，避免覆盖其他服务的删除）
+_DEVICE_LIVE_UPDATE_COLUMNS = tuple(c for c in _DEVICE_UPDATABLE_COLUMNS if c != 'is_deleted')
+_DEVICE_DATETIME_COLUMNS = frozenset((
+    'borrow_time', 'expected_return_date', 'ship_time', 'pre_ship_borrow_time',
+    'pre_ship_expected_return_date', 'lost_time', 'damage_time'
+))
+_DEVICE_RAW_COLUMNS = frozenset(('borrower_id', 'custodian_id', 'previous_status', 'purchase_amount'))
+
+
+def _device_column_value(device: Device, column: str):
+    """按 save_device 的规则转换设备字段值为数据库参数"""
+    value = getattr(device, column)
+    if column in ('device_type', 'status'):
+        return value.value if value else None
+    if column == 'is_deleted':
+        return 1 if value else 0
+    if column in _DEVICE_DATETIME_COLUMNS:
+        return format_datetime(value)
+    if column in _DEVICE_RAW_COLUMNS:
+        return value
+    return escape_percent(value)
+
+
 def init_database():
     """初始化数据库，创建必要的表（只执行一次）"""
     global _db_initialized
@@ -412,6 +447,72 @@ class DatabaseStore:
         init_database()
     
     # ========== 设备相关操作 ==========
+
+    # 设备搜索默认参与匹配的字段（与用户端 /api/search 一致）
+    DEVICE_SEARCH_FIELDS = (
+        'name', 'model', 'borrower',
+        # 车机和仪表字段
+        'jira_address', 'project_attribute', 'connection_method', 'os_version', 'os_platform',
+        'product_name', 'screen_orientation', 'screen_resolution',
+        # 手机字段
+        'system_version', 'imei', 'sn', 'carrier',
+    )
+
+    # 关键词达到该长度时先用全文索引（ft_devices_search）缩小候选范围
+    DEVICE_FULLTEXT_MIN_LENGTH = 3
+
+    # 只有整个关键词都是单词字符时才用全文索引：ngram 分词器在标点等非单词字符处断开，
+    # 断开后不足 ngram_token_size 的片段不产生词元，"1.0"、"V-1" 这类关键词会漏掉 LIKE 能匹配的设备
+    _DEVICE_FULLTEXT_KEYWORD_RE = re.compile(r'\w{%d,}' % DEVICE_FULLTEXT_MIN_LENGTH)
+
+    # 数据库中是否存在设备搜索全文索引（首次查询失败后置为 False，之后只用 LIKE）
+    _device_fulltext_available = True
+
+    @staticmethod
+    def _like_pattern(keyword: str) -> str:
+        """构建子串匹配的 LIKE 模式（转义通配符）"""
+        return '%' + keyword.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+    def search_devices(self, keyword: str, fields: tuple = None, limit: int = None) -> List[Device]:
+        """按关键词搜索设备，按创建时间倒序排列
+
+        大小写不敏感的匹配由表的排序规则（utf8mb4_unicode_ci）完成，不需要在 Python 中逐台设备转小写
+        """
+        fields = fields or self.DEVICE_SEARCH_FIELDS
+        use_fulltext = (
+            self._device_fulltext_available
+            and fields == self.DEVICE_SEARCH_FIELDS
+            and self._DEVICE_FULLTEXT_KEYWORD_RE.fullmatch(keyword) is not None
+        )
+        if use_fulltext:
+            try:
+                return self._search_devices(keyword, fields, limit, use_fulltext=True)
+            except pymysql.MySQLError as e:
+                # 1191: 未创建 ft_devices_search 全文索引（未执行 mysql_indexes_optimization.sql）
+                if not e.args or e.args[0] != 1191:
+                    raise
+                DatabaseStore._device_fulltext_available = False
+        return self._search_devices(keyword, fields, limit)
+
+    def _search_devices(self, keyword: str, fields: tuple, limit: Optional[int], use_fulltext: bool = False) -> List[Device]:
+        """执行设备搜索查询；use_fulltext 时先用全文索引的短语匹配筛出候选，再用 LIKE 精确过滤"""
+        pattern = self._like_pattern(keyword)
+        conditions = ' OR '.join(f"{field} LIKE %s" for field in fields)
+        sql = "SELECT * FROM devices WHERE is_deleted = 0"
+        params = []
+        if use_fulltext:
+            sql += f" AND MATCH({', '.join(fields)}) AGAINST (%s IN BOOLEAN MODE)"
+            params.append(f'"{keyword}"')
+        sql += f" AND ({conditions}) ORDER BY create_time DESC"
+        params += [pattern] * len(fields)
+        if limit:
+            sql += " LIMIT %s"
+            params.append(limit)
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            return [Device.from_dict(row_to_dict(row)) for row in rows]
     
     def get_all_devices(self, device_type: str = None) -> List[Device]:
         """获取所有设备"""
@@ -429,13 +530,33 @@ class DatabaseStore:
             rows = cursor.fetchall()
             return [Device.from_dict(row_to_dict(row)) for row in rows]
     
-    def get_device_by_id(self, device_id: str) -> Optional[Device]:
-        """根据ID获取设备"""
+    def get_device_by_id(self, device_id: str, device_type: str = None) -> Optional[Device]:
+        """根据ID获取设备，指定 device_type 时只在该类型中查找"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            if device_type:
+                cursor.execute(
+                    "SELECT * FROM devices WHERE id = %s AND device_type = %s AND is_deleted = 0",
+                    (device_id, device_type)
+                )
+            else:
+                cursor.execute(
+                    "SELECT * FROM devices WHERE id = %s AND is_deleted = 0",
+                    (device_id,)
+                )
+            row = cursor.fetchone()
+            if row:
+                return Device.from_dict(row_to_dict(row))
+            return None
+
+    def get_device_by_name(self, device_name: str) -> Optional[Device]:
+        """根据名称获取设备（名称按字节精确匹配，区分大小写和末尾空格）"""
         with get_db_connection() as conn:
             cursor = conn.cursor()
+            # name = %s 走 idx_devices_name 索引（utf8mb4_unicode_ci 不区分大小写），再用 BINARY 精确过滤
             cursor.execute(
-                "SELECT * FROM devices WHERE id = %s AND is_deleted = 0",
-                (device_id,)
+                "SELECT * FROM devices WHERE name = %s AND BINARY name = %s AND is_deleted = 0 LIMIT 1",
+                (device_name, device_name)
             )
             row = cursor.fetchone()
             if row:
@@ -604,6 +725,39 @@ class DatabaseStore:
             
             return True
     
+    def update_device_fields(self, device: Device, fields) -> bool:
+        """仅更新未删除设备的指定字段（增量写入，不重写整行）
+
+        设备已被删除或不存在时不写入，返回 False
+        """
+        unknown = [f for f in fields if f not in _DEVICE_UPDATABLE_COLUMNS]
+        if unknown:
+            raise ValueError(f"不支持增量更新的设备字段: {', '.join(unknown)}")
+        if not fields:
+            return True
+        return self._update_live_device_columns(device, fields)
+
+    def update_live_device(self, device: Device) -> bool:
+        """写回未删除设备的全部字段（不修改 is_deleted）
+
+        设备已被删除或不存在时不写入，返回 False
+        """
+        return self._update_live_device_columns(device, _DEVICE_LIVE_UPDATE_COLUMNS)
+
+    def _update_live_device_columns(self, device: Device, columns) -> bool:
+        """更新未删除设备的指定字段，设备已被删除或不存在时返回 False"""
+        with get_db_transaction('devices') as conn:
+            cursor = conn.cursor()
+            assignments = ', '.join(f"{column} = %s" for column in columns)
+            params = [_device_column_value(device, column) for column in columns]
+            params.append(device.id)
+            cursor.execute(f"UPDATE devices SET {assignments} WHERE id = %s AND is_deleted = 0", params)
+            if cursor.rowcount > 0:
+                return True
+            # 字段值均未变化时 rowcount 也为 0，需再确认设备仍存在且未删除
+            cursor.execute("SELECT 1 FROM devices WHERE id = %s AND is_deleted = 0", (device.id,))
+            return cursor.fetchone() is not None
+
     def delete_device(self, device_id: str) -> bool:
         """软删除设备"""
         with get_db_transaction('devices') as conn:
@@ -727,6 +881,17 @@ class DatabaseStore:
             row = cursor.fetchone()
             return row['count'] if row else 0
 
+    def count_borrowed_devices(self, borrower: str) -> int:
+        """获取指定借用人当前借出中的设备数量（使用SQL优化查询）"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COUNT(*) as count FROM devices WHERE borrower = %s AND status = %s AND is_deleted = 0",
+                (borrower, DeviceStatus.BORROWED.value)
+            )
+            row = cursor.fetchone()
+            return row['count'] if row else 0
+
     def get_today_borrow_return_count(self) -> Dict[str, int]:
         """获取今日借出和归还数量"""
         with get_db_connection() as conn:
@@ -869,6 +1034,39 @@ class DatabaseStore:
                 return User.from_dict(row_to_dict(row))
             return None
     
+    def get_admin_borrower_names(self) -> List[str]:
+        """获取所有管理员用户的借用人名称"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT borrower_name FROM users WHERE is_admin = 1 AND is_deleted = 0")
+            return [row['borrower_name'] for row in cursor.fetchall()]
+    
+    def get_active_user_briefs(self) -> List[Dict[str, str]]:
+        """获取可选用户列表（已设置借用人名称且未冻结），只查询ID、名称和邮箱"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, borrower_name, email FROM users "
+                "WHERE is_deleted = 0 AND is_frozen = 0 AND borrower_name IS NOT NULL AND borrower_name <> ''"
+            )
+            return [
+                {'id': row['id'], 'name': row['borrower_name'], 'email': row['email']}
+                for row in cursor.fetchall()
+            ]
+
+    def get_user_by_borrower_name(self, borrower_name: str) -> Optional[User]:
+        """根据借用人名称获取用户"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM users WHERE borrower_name = %s AND is_deleted = 0 LIMIT 1",
+                (borrower_name,)
+            )
+            row = cursor.fetchone()
+            if row:
+                return User.from_dict(row_to_dict(row))
+            return None
+    
     def save_user(self, user: User) -> bool:
         """保存用户"""
         with get_db_transaction('users') as conn:
@@ -950,6 +1148,67 @@ class DatabaseStore:
             rows = cursor.fetchall()
             return [Record.from_dict(row_to_dict(row)) for row in rows]
     
+    def get_records_by_borrower(self, borrower: str) -> List[Record]:
+        """根据借用人获取记录（借用人完全匹配）"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM records WHERE borrower = %s ORDER BY operation_time DESC",
+                (borrower,)
+            )
+            rows = cursor.fetchall()
+            return [Record.from_dict(row_to_dict(row)) for row in rows]
+
+    @staticmethod
+    def _user_related_records_where(borrower_name: str):
+        """构建与用户相关记录的查询条件
+
+        包括：借用人字段包含该用户名、该用户为操作人、以及 reason/remark 中提及该用户的保管人变更记录
+        """
+        pattern = DatabaseStore._like_pattern(borrower_name)
+        where_clause = """WHERE (borrower LIKE %s OR operator = %s
+                OR (operation_type = %s AND (reason LIKE %s OR remark LIKE %s)))"""
+        params = [pattern, borrower_name, OperationType.CUSTODIAN_CHANGE.value, pattern, pattern]
+        return where_clause, params
+
+    def get_records_paginated(self, page: int = 1, per_page: int = 20, borrower_name: str = None) -> Dict[str, Any]:
+        """获取分页记录列表（按时间倒序，指定 borrower_name 时只返回与该用户相关的记录）"""
+        page = max(page, 1)
+        if borrower_name is not None:
+            where_clause, params = self._user_related_records_where(borrower_name)
+        else:
+            where_clause, params = "", []
+
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            # 获取总数
+            cursor.execute(f"SELECT COUNT(*) as total FROM records {where_clause}", params)
+            total = cursor.fetchone()['total']
+
+            # 获取分页数据
+            offset = (page - 1) * per_page
+            cursor.execute(
+                f"SELECT * FROM records {where_clause} ORDER BY operation_time DESC LIMIT %s OFFSET %s",
+                params + [per_page, offset]
+            )
+            rows = cursor.fetchall()
+
+            return {
+                'records': [Record.from_dict(row_to_dict(row)) for row in rows],
+                'total': total,
+                'page': page,
+                'per_page': per_page,
+                'total_pages': (total + per_page - 1) // per_page
+            }
+
+    def count_records_by_operation_type(self) -> Dict[str, int]:
+        """按操作类型统计记录数量"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT operation_type, COUNT(*) as count FROM records GROUP BY operation_type")
+            return {row['operation_type']: row['count'] for row in cursor.fetchall()}
+
     def save_record(self, record: Record) -> bool:
         """保存记录"""
         with get_db_transaction('records') as conn:
@@ -1016,6 +1275,19 @@ class DatabaseStore:
             rows = cursor.fetchall()
             return [UserRemark.from_dict(row_to_dict(row)) for row in rows]
     
+    def get_remark_by_id(self, remark_id: str) -> Optional[UserRemark]:
+        """根据ID获取备注"""
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT * FROM user_remarks WHERE id = %s",
+                (remark_id,)
+            )
+            row = cursor.fetchone()
+            if row:
+                return UserRemark.from_dict(row_to_dict(row))
+            return None
+    
     def get_remarks_by_device(self, device_id: str) -> List[UserRemark]:
         """根据设备ID获取备注"""
         return self.get_remarks(device_id)
@@ -1025,12 +1297,13 @@ class DatabaseStore:
         return self.get_remarks()
     
     def save_remark(self, remark: UserRemark) -> bool:
-        """保存备注"""
+        """保存备注（已存在时更新内容和不当标记）"""
         with get_db_transaction('default') as conn:
             cursor = conn.cursor()
             sql = """INSERT INTO user_remarks (
                 id, device_id, device_type, content, creator, create_time, is_inappropriate
             ) VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE content = VALUES(content), is_inappropriate = VALUES(is_inappropriate)
             """
             params = (
                 remark.id, remark.device_id, remark.device_type,
@@ -1039,6 +1312,27 @@ class DatabaseStore:
             )
             cursor.execute(sql, params)
             return True
+
+    def delete_remark(self, remark_id: str) -> bool:
+        """根据ID删除备注（主键删除，不需要先加载全部备注）"""
+        with get_db_transaction('default') as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM user_remarks WHERE id = %s", (remark_id,))
+            return cursor.rowcount > 0
+
+    def mark_remark_inappropriate(self, remark_id: str, is_inappropriate: bool) -> bool:
+        """设置备注的不当标记"""
+        with get_db_transaction('default') as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE user_remarks SET is_inappropriate = %s WHERE id = %s",
+                (1 if is_inappropriate else 0, remark_id)
+            )
+            if cursor.rowcount > 0:
+                return True
+            # 标记未变化时 rowcount 为 0，需再确认备注是否存在
+            cursor.execute("SELECT 1 FROM user_remarks WHERE id = %s", (remark_id,))
+            return cursor.fetchone() is not None
     
     # ========== 管理员相关操作 ==========
     
@@ -1152,6 +1446,30 @@ class DatabaseStore:
             cursor.execute(sql, params)
             return True
 
+    def save_operation_logs(self, logs: List[OperationLog]) -> bool:
+        """批量保存操作日志（单个事务提交）"""
+        if not logs:
+            return True
+        with get_db_transaction('records') as conn:
+            cursor = conn.cursor()
+            sql = """INSERT INTO operation_logs (
+                id, operation_time, operator, operation_content, device_info, source
+            ) VALUES (%s, %s, %s, %s, %s, %s)
+            """
+            params = [
+                (
+                    log.id,
+                    format_datetime(log.operation_time),
+                    log.operator,
+                    log.operation_content,
+                    log.device_info,
+                    log.source
+                )
+                for log in logs
+            ]
+            cursor.executemany(sql, params)
+            return True
+
     # ========== 后台管理操作日志相关操作 ==========
 
     def save_admin_operation_log(self, log: AdminOperationLog) -> bool:
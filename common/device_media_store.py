@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+设备媒体数据存储模块
+设备图片、附件的元数据保存在本地JSON文件中；进程内保留一份数据，
+每次修改只向日志文件追加一行并落盘，完整快照由后台线程定期重写并清空日志
+
+同一数据目录可能被多个进程同时使用（多个服务实例、调试模式的重载进程等），
+读写前都持有跨进程文件锁，并先同步其他进程写入的快照和日志
+"""
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+# 尝试导入orjson（更快的JSON序列化，直接输出bytes），未安装时使用标准库json
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# 跨进程文件锁：POSIX 使用 fcntl.flock，Windows 使用 msvcrt.locking
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    import msvcrt
+    FCNTL_AVAILABLE = False
+
+# 快照合并间隔（秒）：有修改后等待该时间再重写一次快照并清空日志
+COMPACT_DELAY = 30
+
+# 快照写缓冲区的保留上限：超过后写完即释放，避免长期占用大块内存
+SNAPSHOT_BUF_SOFT_CAP = 128 * 1024
+
+# 媒体类型
+MEDIA_KINDS = ('images', 'attachments')
+
+
+def _dumps(obj, indent: bool = False) -> bytes:
+    """序列化为UTF-8编码的JSON（中文不转义）"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode('utf-8')
+
+
+def _loads(data: bytes):
+    """反序列化JSON（orjson.JSONDecodeError 是 json.JSONDecodeError 的子类）"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class DeviceMediaStore:
+    """设备媒体数据存储类（图片/附件元数据）
+
+    快照文件为 device_media.json，修改日志为同目录下的 device_media.log（JSON Lines），
+    文件锁为 device_media.lock。内存数据 = 快照 + 已重放到 _log_offset 的日志；
+    快照被其他进程重写后整体重新加载，否则只重放日志中新增的部分
+    """
+
+    def __init__(self, path: str, compact_delay: float = COMPACT_DELAY):
+        self._path = path
+        base_path = os.path.splitext(path)[0]
+        self._log_path = base_path + '.log'
+        self._lock_path = base_path + '.lock'
+        self._compact_delay = compact_delay
+        # 保护内存数据和文件描述符（线程间），跨进程由文件锁保护
+        self._lock = threading.RLock()
+        self._lock_fd = None
+        self._lock_depth = 0
+        self._log_fd = None
+        # 内存数据对应的快照文件标识和已重放的日志字节数
+        self._data = self._empty_data()
+        self._snapshot_sig = False
+        self._log_offset = 0
+        # 快照序列化缓冲区，跨次复用
+        self._snapshot_buf = bytearray()
+        self._dirty = threading.Event()
+        self._writer_thread = None
+        self._writer_thread_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+        with self._locked():
+            replayed, torn = self._sync()
+        if replayed or torn:
+            # 启动时重放过日志：立即合并为快照并清空日志
+            self._dirty.set()
+            try:
+                self.flush()
+            except OSError as e:
+                self._safe_print(f"⚠ 设备媒体快照写入失败: {e}")
+                self._mark_dirty()
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _safe_print(message):
+        """安全打印，处理Windows控制台编码问题"""
+        try:
+            print(message)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _empty_data() -> Dict[str, Dict[str, List[dict]]]:
+        return {kind: {} for kind in MEDIA_KINDS}
+
+    def _after_fork(self):
+        """fork 出的子进程不能沿用父进程的文件描述符（flock 锁在父子进程间共享）"""
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        for fd in (self._lock_fd, self._log_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._lock_fd = None
+        self._log_fd = None
+
+    @contextmanager
+    def _locked(self):
+        """持有线程锁和跨进程文件锁（可重入）"""
+        with self._lock:
+            if self._lock_depth == 0:
+                if self._lock_fd is None:
+                    self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+                if FCNTL_AVAILABLE:
+                    fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+                else:
+                    os.lseek(self._lock_fd, 0, os.SEEK_SET)
+                    msvcrt.locking(self._lock_fd, msvcrt.LK_LOCK, 1)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    if FCNTL_AVAILABLE:
+                        fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+                    else:
+                        os.lseek(self._lock_fd, 0, os.SEEK_SET)
+                        msvcrt.locking(self._lock_fd, msvcrt.LK_UNLCK, 1)
+
+    def _snapshot_signature(self):
+        """快照文件标识：快照被重写（os.replace）后会变化"""
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def _read_snapshot(self) -> Dict[str, Dict[str, List[dict]]]:
+        """读取快照文件"""
+        data = {}
+        if os.path.exists(self._path):
+            try:
+                with open(self._path, 'rb') as f:
+                    content = f.read().strip()
+                    if content:
+                        data = _loads(content)
+            except (json.JSONDecodeError, IOError):
+                data = {}
+        for kind in MEDIA_KINDS:
+            data.setdefault(kind, {})
+        return data
+
+    def _sync(self):
+        """同步磁盘上的快照和日志到内存（调用方需持有 self._locked()）
+
+        Returns:
+            (重放的日志条数, 是否截掉了不完整的日志行)
+        """
+        sig = self._snapshot_signature()
+        try:
+            log_size = os.path.getsize(self._log_path)
+        except FileNotFoundError:
+            log_size = 0
+        if sig != self._snapshot_sig or log_size < self._log_offset:
+            # 快照被重写（其他进程合并过）：重新加载快照并从头重放日志
+            self._data = self._read_snapshot()
+            self._snapshot_sig = sig
+            self._log_offset = 0
+        if log_size == self._log_offset:
+            return 0, False
+
+        replayed = 0
+        torn = False
+        offset = self._log_offset
+        with open(self._log_path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                # 以换行结尾的行才算写完整；进程异常退出时最后一行可能未写完整
+                if not line.endswith(b'\n'):
+                    torn = True
+                    break
+                stripped = line.strip()
+                if stripped:
+                    try:
+                        entry = _loads(stripped)
+                    except json.JSONDecodeError:
+                        torn = True
+                        break
+                    self._apply(self._data, entry)
+                    replayed += 1
+                offset += len(line)
+        if torn:
+            # 写日志时持有文件锁，不完整的行只能来自异常退出的进程；
+            # 截掉它，否则之后追加的记录会接在半行后面，下次加载时无法解析
+            os.truncate(self._log_path, offset)
+        self._log_offset = offset
+        return replayed, torn
+
+    @staticmethod
+    def _apply(data: Dict[str, Dict[str, List[dict]]], entry: dict):
+        """把一条修改记录应用到数据上"""
+        kind, device_id = entry['kind'], entry['device_id']
+        if entry['op'] == 'add':
+            # 重放时快照可能已包含这些记录（快照替换后、清空日志前退出），按ID去重
+            items = data[kind].setdefault(device_id, [])
+            existing_ids = {item['id'] for item in items}
+            items.extend(item for item in entry['items'] if item['id'] not in existing_ids)
+        elif entry['op'] == 'remove':
+            items = data[kind].get(device_id, [])
+            data[kind][device_id] = [item for item in items if item['id'] != entry['id']]
+
+    @staticmethod
+    def _write_all(fd: int, data):
+        """写入全部数据（普通文件一次 os.write 即可写完）"""
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+
+    def _append_log(self, entry: dict):
+        """追加一条修改记录到日志文件并落盘（调用方需持有 self._locked() 且已同步）"""
+        if self._log_fd is None:
+            self._log_fd = os.open(self._log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        line = _dumps(entry) + b'\n'
+        self._write_all(self._log_fd, line)
+        os.fsync(self._log_fd)
+        self._log_offset += len(line)
+
+    def _record(self, entry: dict):
+        """写日志后应用修改，并通知后台线程稍后重写快照"""
+        with self._locked():
+            self._sync()
+            self._append_log(entry)
+            self._apply(self._data, entry)
+        self._mark_dirty()
+
+    def _compact(self):
+        """重写完整快照并清空修改日志"""
+        with self._locked():
+            # 先合并其他进程追加的日志，再重写快照
+            self._sync()
+            buf = self._snapshot_buf
+            buf.clear()
+            buf.extend(_dumps(self._data, indent=True))
+            # 先写临时文件再原子替换，避免进程中途退出留下不完整的快照
+            tmp_path = self._path + '.tmp'
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                self._write_all(fd, buf)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp_path, self._path)
+            self._fsync_dir()
+            self._snapshot_sig = self._snapshot_signature()
+            if len(buf) > SNAPSHOT_BUF_SOFT_CAP:
+                self._snapshot_buf = bytearray()
+
+            # 只清空不删除：其他进程可能仍以追加方式打开着日志文件
+            if self._log_fd is not None:
+                os.ftruncate(self._log_fd, 0)
+                os.fsync(self._log_fd)
+            elif os.path.exists(self._log_path):
+                os.truncate(self._log_path, 0)
+            self._log_offset = 0
+
+    def _fsync_dir(self):
+        """同步快照所在目录，确保 rename 落盘（Windows 不支持打开目录，跳过）"""
+        if os.name == 'nt':
+            return
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self._path)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def _mark_dirty(self):
+        """标记有未写入快照的修改，由后台线程定期合并"""
+        self._ensure_writer_thread()
+        self._dirty.set()
+
+    def _ensure_writer_thread(self):
+        """按需启动快照线程（fork 出的子进程中会重新启动）"""
+        if self._writer_thread is not None and self._writer_thread.is_alive():
+            return
+        with self._writer_thread_lock:
+            if self._writer_thread is None or not self._writer_thread.is_alive():
+                self._writer_thread = threading.Thread(
+                    target=self._writer_loop, name="device_media_writer", daemon=True
+                )
+                self._writer_thread.start()
+
+    def _writer_loop(self):
+        """后台线程：有修改后等待合并间隔，再重写一次快照"""
+        while True:
+            self._dirty.wait()
+            time.sleep(self._compact_delay)
+            self._dirty.clear()
+            try:
+                self._compact()
+            except OSError as e:
+                self._safe_print(f"⚠ 设备媒体快照写入失败: {e}")
+                self._dirty.set()
+
+    def flush(self):
+        """立即重写快照并清空日志（进程退出时调用）"""
+        if self._dirty.is_set():
+            self._dirty.clear()
+            self._compact()
+
+    def _find_item(self, kind: str, device_id: str, item_id: str) -> Optional[dict]:
+        """在内存数据中查找媒体记录（调用方需持有 self._locked() 且已同步）"""
+        for item in self._data[kind].get(device_id, []):
+            if item['id'] == item_id:
+                return item
+        return None
+
+    def get_items(self, kind: str, device_id: str) -> List[dict]:
+        """获取设备的媒体列表，按上传时间倒序排列"""
+        with self._locked():
+            self._sync()
+            items = list(self._data[kind].get(device_id, []))
+        items.sort(key=lambda x: x.get('upload_time', ''), reverse=True)
+        return items
+
+    def find_item(self, kind: str, device_id: str, item_id: str) -> Optional[dict]:
+        """根据ID查找设备的某个媒体记录"""
+        with self._locked():
+            self._sync()
+            return self._find_item(kind, device_id, item_id)
+
+    def add_items(self, kind: str, device_id: str, items: List[dict]):
+        """为设备追加媒体记录"""
+        if not items:
+            return
+        self._record({'op': 'add', 'kind': kind, 'device_id': device_id, 'items': items})
+
+    def remove_item(self, kind: str, device_id: str, item_id: str) -> bool:
+        """删除设备的某个媒体记录"""
+        with self._locked():
+            self._sync()
+            if self._find_item(kind, device_id, item_id) is None:
+                return False
+            self._record({'op': 'remove', 'kind': kind, 'device_id': device_id, 'id': item_id})
+        return True
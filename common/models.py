@@ -2,11 +2,15 @@
 """
 数据模型定义
 """
+import sys
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
 from typing import Optional, List
 from enum import Enum
 
+# 高频创建的数据类使用 __slots__ 存储（Python 3.10+ 才支持 dataclass(slots=True)）
+_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
 
 def _parse_bool(value, default=True):
     """解析布尔值，处理多种输入格式（bool, int, str）"""
@@ -159,6 +163,13 @@ class Device:
         """初始化后，如果没有设置创建时间，则设置为当前时间"""
         if self.create_time is None:
             self.create_time = datetime.now()
+
+    @property
+    def device_type_label(self) -> str:
+        """设备类型字符串（子类以类属性覆盖，无需 isinstance 判断）"""
+        if isinstance(self.device_type, DeviceType):
+            return self.device_type.value
+        return str(self.device_type) if self.device_type else "未知"
     
     @classmethod
     def from_dict(cls, data: dict) -> 'Device':
@@ -287,6 +298,8 @@ class Device:
 @dataclass
 class CarMachine(Device):
     """车机设备"""
+    device_type_label = "车机"
+
     def __init__(self, **kwargs):
         kwargs['device_type'] = DeviceType.CAR_MACHINE
         super().__init__(**kwargs)
@@ -295,6 +308,8 @@ class CarMachine(Device):
 @dataclass
 class Instrument(Device):
     """仪表设备"""
+    device_type_label = "仪表"
+
     def __init__(self, **kwargs):
         kwargs['device_type'] = DeviceType.INSTRUMENT
         super().__init__(**kwargs)
@@ -303,6 +318,8 @@ class Instrument(Device):
 @dataclass
 class Phone(Device):
     """手机设备"""
+    device_type_label = "手机"
+
     def __init__(self, **kwargs):
         kwargs['device_type'] = DeviceType.PHONE
         super().__init__(**kwargs)
@@ -311,6 +328,8 @@ class Phone(Device):
 @dataclass
 class SimCard(Device):
     """手机卡设备"""
+    device_type_label = "手机卡"
+
     def __init__(self, **kwargs):
         kwargs['device_type'] = DeviceType.SIM_CARD
         super().__init__(**kwargs)
@@ -319,12 +338,14 @@ class SimCard(Device):
 @dataclass
 class OtherDevice(Device):
     """其它设备"""
+    device_type_label = "其它设备"
+
     def __init__(self, **kwargs):
         kwargs['device_type'] = DeviceType.OTHER_DEVICE
         super().__init__(**kwargs)
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class Record:
     """借还记录"""
     id: str
@@ -451,7 +472,7 @@ class UserRemark:
         }
 
 
-@dataclass
+@dataclass(**_SLOTS)
 class User:
     """用户信息"""
     id: str
@@ -2,6 +2,11 @@
 """
 工具函数模块
 """
+import re
+from functools import lru_cache
+
+# 移动设备 User-Agent 关键字（导入时编译一次）
+_MOBILE_UA_RE = re.compile(r'mobile|android|iphone|ipad|wechat|micromessenger|windows phone', re.IGNORECASE)
 
 
 def mask_phone(phone):
@@ -11,8 +16,12 @@ def mask_phone(phone):
     return phone
 
 
+@lru_cache(maxsize=256)
+def _is_mobile_user_agent(user_agent):
+    """检测 User-Agent 是否为移动设备（同一 User-Agent 只匹配一次）"""
+    return _MOBILE_UA_RE.search(user_agent) is not None
+
+
 def is_mobile_device(request):
     """检测是否为移动设备"""
-    user_agent = request.headers.get('User-Agent', '').lower()
-    mobile_keywords = ['mobile', 'android', 'iphone', 'ipad', 'wechat', 'micromessenger', 'windows phone']
-    return any(keyword in user_agent for keyword in mobile_keywords)
+    return _is_mobile_user_agent(request.headers.get('User-Agent', ''))
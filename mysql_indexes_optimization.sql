@@ -20,6 +20,18 @@ ON devices(device_type, status, is_deleted);
 CREATE INDEX idx_devices_borrower 
 ON devices(borrower, status);
 
+-- 用于按设备名称查找（新增设备时的重名检查）
+CREATE INDEX idx_devices_name 
+ON devices(name);
+
+-- 用于设备关键词搜索（/api/search）：ngram 全文索引按 2 字符切分，先用它缩小候选再用 LIKE 精确匹配
+-- 列顺序必须与 DatabaseStore.DEVICE_SEARCH_FIELDS 一致；关闭停用词，避免含 a/i 等字母的切片被丢弃
+SET SESSION innodb_ft_enable_stopword = 0;
+CREATE FULLTEXT INDEX ft_devices_search 
+ON devices(name, model, borrower, jira_address, project_attribute, connection_method, os_version, os_platform,
+           product_name, screen_orientation, screen_resolution, system_version, imei, sn, carrier)
+WITH PARSER ngram;
+
 -- ============================================
 -- 2. 用户表 (users) 索引优化
 -- ============================================
@@ -144,7 +144,12 @@ def start_service_waitress(service_name, app_module, app_var, port):
         
         # 计算线程数
         cpu_count = get_cpu_count()
-        threads = min(cpu_count * 2, 16)  # 线程数 = CPU核心数 * 2，最大16
+        if app_module == 'user_service.app':
+            # 用户服务使用统一配置的线程数（可通过环境变量 USER_SERVICE_THREADS 调整）
+            from common.config import USER_SERVICE_THREADS
+            threads = USER_SERVICE_THREADS
+        else:
+            threads = min(cpu_count * 2, 16)  # 线程数 = CPU核心数 * 2，最大16
         
         print(f"       配置: {threads}线程, CPU核心: {cpu_count}")
         
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+设备媒体存储的日志重放测试
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import device_media_store
+from common.device_media_store import DeviceMediaStore
+
+# 测试中不让后台线程自动合并快照
+NO_COMPACT = 3600
+
+
+@pytest.fixture(autouse=True)
+def no_atexit_flush(monkeypatch):
+    """测试中创建的实例不在进程退出时写快照（临时目录届时可能已删除）"""
+    monkeypatch.setattr(device_media_store.atexit, 'register', lambda func: None)
+
+
+def _item(item_id):
+    return {'id': item_id, 'upload_time': item_id}
+
+
+def _ids(store, device_id='d1'):
+    return sorted(item['id'] for item in store.get_items('images', device_id))
+
+
+def _open_store(tmp_path):
+    return DeviceMediaStore(str(tmp_path / 'device_media.json'), compact_delay=NO_COMPACT)
+
+
+def _log_path(tmp_path):
+    return str(tmp_path / 'device_media.log')
+
+
+def test_replay_log_after_restart(tmp_path):
+    store = _open_store(tmp_path)
+    store.add_items('images', 'd1', [_item('a'), _item('b')])
+    store.remove_item('images', 'd1', 'a')
+
+    # 未合并快照就重启：数据来自日志重放，重放后立即合并并清空日志
+    store = _open_store(tmp_path)
+    assert _ids(store) == ['b']
+    assert not os.path.exists(_log_path(tmp_path)) or os.path.getsize(_log_path(tmp_path)) == 0
+    assert _ids(_open_store(tmp_path)) == ['b']
+
+
+def test_torn_last_line_does_not_swallow_later_entries(tmp_path):
+    store = _open_store(tmp_path)
+    store.add_items('images', 'd1', [_item('a')])
+    store.add_items('images', 'd1', [_item('x')])
+
+    # 模拟写最后一行时进程退出：去掉最后一行的后半截
+    with open(_log_path(tmp_path), 'rb') as f:
+        content = f.read()
+    with open(_log_path(tmp_path), 'wb') as f:
+        f.write(content[:-10])
+
+    store = _open_store(tmp_path)
+    assert _ids(store) == ['a']
+    store.add_items('images', 'd1', [_item('b')])
+
+    assert _ids(_open_store(tmp_path)) == ['a', 'b']
+
+
+def test_torn_line_is_truncated_when_snapshot_cannot_be_written(tmp_path, monkeypatch):
+    store = _open_store(tmp_path)
+    store.add_items('images', 'd1', [_item('a')])
+    with open(_log_path(tmp_path), 'ab') as f:
+        f.write(b'{"op": "add", "ki')
+
+    def fail_compact(self):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(DeviceMediaStore, '_compact', fail_compact)
+    monkeypatch.setattr(DeviceMediaStore, '_ensure_writer_thread', lambda self: None)
+    store = _open_store(tmp_path)
+    store.add_items('images', 'd1', [_item('b')])
+    monkeypatch.undo()
+
+    assert _ids(_open_store(tmp_path)) == ['a', 'b']
+
+
+def test_replay_is_idempotent_when_snapshot_already_has_entries(tmp_path):
+    store = _open_store(tmp_path)
+    store.add_items('images', 'd1', [_item('a')])
+    with open(_log_path(tmp_path), 'rb') as f:
+        log_content = f.read()
+    store.flush()
+
+    # 快照替换后、清空日志前退出：日志里的记录已包含在快照中
+    with open(_log_path(tmp_path), 'wb') as f:
+        f.write(log_content)
+
+    assert _ids(_open_store(tmp_path)) == ['a']
+
+
+def test_instances_sharing_a_data_dir_see_each_others_changes(tmp_path):
+    # 两个实例模拟同一数据目录上的两个进程
+    first = _open_store(tmp_path)
+    second = _open_store(tmp_path)
+    first.add_items('images', 'd1', [_item('a')])
+    second.add_items('images', 'd1', [_item('b')])
+    assert _ids(first) == ['a', 'b']
+
+    # 一个实例合并快照时不能丢掉另一个实例追加的日志
+    first.flush()
+    second.add_items('images', 'd1', [_item('c')])
+    second.remove_item('images', 'd1', 'a')
+    assert _ids(first) == ['b', 'c']
+    second.flush()
+    first.add_items('images', 'd1', [_item('d')])
+
+    assert _ids(_open_store(tmp_path)) == ['b', 'c', 'd']
@@ -11,31 +11,34 @@ import sys
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 
 import uuid
-import io
 import base64
 import re
-import json
 import calendar
 import urllib.request
 import urllib.parse
 from datetime import datetime, timedelta
-from functools import wraps
+from collections import Counter
+from itertools import islice
+from functools import wraps, lru_cache
+from contextlib import nullcontext
 
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for, make_response, send_file, send_from_directory
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, make_response, send_file, send_from_directory, g
 from dotenv import load_dotenv
+from jinja2 import FileSystemBytecodeCache
 
 # 从 common 导入
-from common.models import DeviceStatus, DeviceType, OperationType, EntrySource, ReservationStatus, CarMachine, Instrument, Phone, SimCard, OtherDevice, Record, UserRemark, User, ViewRecord, PointsTransactionType
-from common.api_client import api_client
+from common.models import DeviceStatus, DeviceType, OperationType, EntrySource, ReservationStatus, Record, UserRemark, User, ViewRecord, PointsTransactionType
+from common.api_client import api_client, DeviceDeletedError
 from common.db_store import DatabaseStore, init_database
 from common.utils import mask_phone, is_mobile_device
-from common.config import SECRET_KEY, SERVER_URL, USER_SERVICE_PORT
+from common.config import SECRET_KEY, SERVER_URL, USER_SERVICE_PORT, USER_SERVICE_THREADS
 from common.points_service import points_service
+from common.device_media_store import DeviceMediaStore
 
 # 尝试导入qrcode，如果没有安装则使用备用方案
 try:
     import qrcode
-    from qrcode.image.pil import PilImage
+    from qrcode.image.svg import SvgPathImage
     QRCODE_AVAILABLE = True
 except ImportError:
     QRCODE_AVAILABLE = False
@@ -49,11 +52,44 @@ except ImportError:
     APSCHEDULER_AVAILABLE = False
     print("警告: APScheduler模块未安装，定时任务功能将不可用")
 
+# 尝试导入orjson用于加速JSON序列化，如果没有安装则使用Flask默认的json模块
+try:
+    import orjson
+    from flask.json.provider import DefaultJSONProvider
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
 
+if ORJSON_AVAILABLE:
+    class ORJSONProvider(DefaultJSONProvider):
+        """使用 orjson 的 JSON 序列化/反序列化
+
+        datetime 等 orjson 不按 Flask 方式处理的类型交给 Flask 默认的 default 处理，保持输出格式不变
+        """
+        _options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=self._options).decode()
+
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+
+        def response(self, *args, **kwargs):
+            """jsonify 使用：orjson 输出的 bytes 直接作为响应体，省去 decode 后再编码"""
+            obj = self._prepare_response_obj(args, kwargs)
+            option = self._options
+            if (self.compact is None and self._app.debug) or self.compact is False:
+                option |= orjson.OPT_INDENT_2
+            body = orjson.dumps(obj, default=self.default, option=option | orjson.OPT_APPEND_NEWLINE)
+            return self._app.response_class(body, mimetype=self.mimetype)
+
+    app.json = ORJSONProvider(app)
+
 # 初始化数据库（创建必要的表）
 init_database()
 
@@ -78,6 +114,17 @@ def nan_to_default(value, default='-'):
     return value
 
 
+# 模板缓存：非调试模式下不再逐次检查模板文件是否修改，编译结果写入磁盘字节码缓存，
+# 并在启动时预编译全部模板，避免首个请求承担模板解析开销
+app.jinja_env.auto_reload = app.debug
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(pattern='user_service-%s.cache')
+for _template_name in app.jinja_env.list_templates(extensions=['html']):
+    try:
+        app.jinja_env.get_template(_template_name)
+    except Exception as e:
+        print(f"预编译模板失败 {_template_name}: {e}")
+
+
 def login_required(f):
     """登录验证装饰器 - 未登录跳转到设备选择页面"""
     @wraps(f)
@@ -99,14 +146,45 @@ def get_user_total_points(user_id: str) -> int:
     return user_points.points if user_points else 0
 
 
+@app.before_request
+def load_request_user():
+    """请求开始时记录当前时间到 flask.g.now，并解析一次当前登录用户到 flask.g.user（静态文件请求跳过）"""
+    # 同一请求内的操作时间、借用时间等统一使用这一个时间
+    g.now = datetime.now()
+    if request.endpoint != 'static':
+        g.user = _load_current_user()
+
+
 def get_current_user():
-    """获取当前登录用户信息"""
+    """获取当前登录用户信息（由 load_request_user 在请求开始时解析）"""
+    if 'user' not in g:
+        g.user = _load_current_user()
+    return g.user
+
+
+def get_request_devices(device_type=None):
+    """获取所有设备（同一请求内只查询一次，结果缓存在 flask.g 上）
+
+    指定 device_type（如 '车机'）时从缓存的全部设备中筛选，不再单独查询数据库。
+    仅用于只读页面/统计，修改设备后需要最新数据时请直接调用 api_client.get_all_devices()
+    """
+    if 'all_devices' not in g:
+        g.all_devices = api_client.get_all_devices()
+    if device_type:
+        return [d for d in g.all_devices if d.device_type.value == device_type]
+    return g.all_devices
+
+
+def stripped_form(keys):
+    """一次性读取表单字段并去除首尾空白，缺失字段返回空字符串"""
+    form = request.form
+    return {key: form.get(key, '').strip() for key in keys}
+
+
+def _load_current_user():
+    """从数据库加载当前登录用户信息"""
     user_id = session.get('user_id', '')
-    user = None
-    for u in api_client._users:
-        if u.id == user_id:
-            user = u
-            break
+    user = api_client.get_user_by_id(user_id) if user_id else None
 
     if user:
         # 获取用户当前积分
@@ -126,8 +204,13 @@ def get_current_user():
 
 
 def is_admin_user(borrower_name):
-    """检查指定借用人是否为管理员"""
-    return api_client.is_user_admin(borrower_name)
+    """检查指定借用人是否为管理员
+
+    模板中会对每条记录调用，管理员名称集合在同一请求内只查询一次
+    """
+    if 'admin_names' not in g:
+        g.admin_names = api_client.get_admin_names()
+    return borrower_name in g.admin_names
 
 
 def get_current_theme_icon(user_id):
@@ -195,43 +278,48 @@ def get_user_equipment(user_id):
     return result
 
 
-def get_device_type_str(device):
-    """获取设备类型字符串"""
-    # 方式1：通过实例类型判断
-    if isinstance(device, CarMachine):
-        return "车机"
-    elif isinstance(device, Instrument):
-        return "仪表"
-    elif isinstance(device, Phone):
-        return "手机"
-    elif isinstance(device, SimCard):
-        return "手机卡"
-    elif isinstance(device, OtherDevice):
-        return "其它设备"
-
-    # 方式2：通过 device_type 属性判断（当实例类型不匹配时）
-    if hasattr(device, 'device_type') and device.device_type:
-        if isinstance(device.device_type, DeviceType):
-            return device.device_type.value
-        return str(device.device_type)
+def get_device_search_text(device):
+    """获取设备的搜索文本（PC端设备列表使用）
 
-    return "未知"
+    将参与搜索的字段用 \\x00 拼接后统一转小写并移除空格，每台设备只做一次
+    lower/replace，同时分隔符保证搜索词不会跨字段匹配。
+    """
+    fields = [device.name, device.model or '', device.borrower or '', device.jira_address or '',
+              device.remark or '', device.status.value, device.device_type.value]
+    if device.device_type in (DeviceType.CAR_MACHINE, DeviceType.INSTRUMENT):
+        # 车机/仪表特有字段
+        fields += [device.project_attribute or '', device.connection_method or '', device.os_version or '',
+                   device.os_platform or '', device.product_name or '', device.screen_orientation or '',
+                   device.screen_resolution or '', device.hardware_version or '']
+    elif device.device_type == DeviceType.PHONE:
+        # 手机特有字段
+        fields += [device.system_version or '', device.imei or '', device.sn or '', device.carrier or '']
+    elif device.device_type == DeviceType.SIM_CARD:
+        # 手机卡特有字段
+        fields.append(device.carrier or '')
+    return '\x00'.join(fields).lower().replace(' ', '')
+
+
+# 统计为"可借"/"无法使用"的设备状态
+_AVAILABLE_STATUSES = (DeviceStatus.IN_STOCK, DeviceStatus.IN_CUSTODY, DeviceStatus.CIRCULATING, DeviceStatus.NO_CABINET)
+_UNAVAILABLE_STATUSES = (DeviceStatus.LOST, DeviceStatus.DAMAGED, DeviceStatus.SHIPPED, DeviceStatus.SCRAPPED, DeviceStatus.SEALED)
 
 
 def get_device_stats():
     """获取设备统计数据"""
-    api_client.reload_data()
-    all_devices = api_client.get_all_devices()
+    all_devices = get_request_devices()
     total_devices = len(all_devices)
-    available_devices = len([d for d in all_devices if d.status in [DeviceStatus.IN_STOCK, DeviceStatus.IN_CUSTODY, DeviceStatus.CIRCULATING, DeviceStatus.NO_CABINET]])
-    borrowed_devices_count = len([d for d in all_devices if d.status == DeviceStatus.BORROWED])
+    # 一次遍历统计各状态数量
+    status_counts = Counter(d.status for d in all_devices)
+    available_devices = sum(status_counts[s] for s in _AVAILABLE_STATUSES)
+    borrowed_devices_count = status_counts[DeviceStatus.BORROWED]
 
     # 详细状态统计
-    in_stock_count = len([d for d in all_devices if d.status == DeviceStatus.IN_STOCK])  # 在库
-    in_custody_count = len([d for d in all_devices if d.status == DeviceStatus.IN_CUSTODY])  # 保管中
-    no_cabinet_count = len([d for d in all_devices if d.status == DeviceStatus.NO_CABINET])  # 无柜号
-    circulating_count = len([d for d in all_devices if d.status == DeviceStatus.CIRCULATING])  # 流通
-    sealed_count = len([d for d in all_devices if d.status == DeviceStatus.SEALED])  # 封存
+    in_stock_count = status_counts[DeviceStatus.IN_STOCK]  # 在库
+    in_custody_count = status_counts[DeviceStatus.IN_CUSTODY]  # 保管中
+    no_cabinet_count = status_counts[DeviceStatus.NO_CABINET]  # 无柜号
+    circulating_count = status_counts[DeviceStatus.CIRCULATING]  # 流通
+    sealed_count = status_counts[DeviceStatus.SEALED]  # 封存
 
     # 获取车机/仪表筛选选项
     car_devices = [d for d in all_devices if d.device_type.value in ['车机', '仪表']]
@@ -241,7 +329,7 @@ def get_device_stats():
     resolutions = sorted(set(d.screen_resolution for d in car_devices if d.screen_resolution))
 
     # 计算无法使用的设备数量
-    unavailable_count = len([d for d in all_devices if d.status in [DeviceStatus.LOST, DeviceStatus.DAMAGED, DeviceStatus.SHIPPED, DeviceStatus.SCRAPPED, DeviceStatus.SEALED]])
+    unavailable_count = sum(status_counts[s] for s in _UNAVAILABLE_STATUSES)
 
     return {
         'total_devices': total_devices,
@@ -420,8 +508,8 @@ def select_device_type():
 def mobile_login():
     """手机端登录页面 - 使用邮箱登录，与PC端保持一致"""
     if request.method == 'POST':
-        email = request.form.get('email', '').strip().lower()
-        password = request.form.get('password', '').strip()
+        form = stripped_form(('email', 'password'))
+        email, password = form['email'].lower(), form['password']
 
         if not email or not password:
             return render_template('mobile/login.html', error='请输入邮箱和密码')
@@ -467,8 +555,8 @@ def mobile_login():
 def pc_login():
     """电脑端登录页面 - 不带二维码"""
     if request.method == 'POST':
-        email = request.form.get('email', '').strip()
-        password = request.form.get('password', '').strip()
+        form = stripped_form(('email', 'password'))
+        email, password = form['email'], form['password']
 
         if not email or not password:
             return render_template('pc/login.html', error='请输入邮箱和密码')
@@ -526,10 +614,11 @@ def login():
 def register():
     """用户注册页面"""
     if request.method == 'POST':
-        borrower_name = request.form.get('borrower_name', '').strip()
-        email = request.form.get('email', '').strip()
-        password = request.form.get('password', '').strip()
-        confirm_password = request.form.get('confirm_password', '').strip()
+        form = stripped_form(('borrower_name', 'email', 'password', 'confirm_password'))
+        borrower_name = form['borrower_name']
+        email = form['email']
+        password = form['password']
+        confirm_password = form['confirm_password']
 
         # 验证输入
         if not all([borrower_name, email, password, confirm_password]):
@@ -548,6 +637,25 @@ def register():
     return render_template('register.html')
 
 
+@lru_cache(maxsize=8)
+def _render_qrcode_svg(qr_content):
+    """生成二维码SVG的base64字符串（内容基本固定，按内容缓存）
+
+    使用 SvgPathImage 直接输出矢量图，无需经过 PIL 栅格化和 PNG 压缩
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(qr_content)
+    qr.make(fit=True)
+
+    img = qr.make_image(image_factory=SvgPathImage)
+    return base64.b64encode(img.to_string()).decode()
+
+
 @app.route('/login/qrcode')
 def login_qrcode():
     """生成登录二维码"""
@@ -560,26 +668,11 @@ def login_qrcode():
         
         if QRCODE_AVAILABLE:
             # 使用qrcode模块生成
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_L,
-                box_size=10,
-                border=4,
-            )
-            qr.add_data(qr_content)
-            qr.make(fit=True)
-            
-            # 创建图像
-            img = qr.make_image(fill_color="black", back_color="white")
-            
-            # 转换为base64
-            buffered = io.BytesIO()
-            img.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
+            img_str = _render_qrcode_svg(qr_content)
             
             return jsonify({
                 'success': True,
-                'qrcode': f'data:image/png;base64,{img_str}',
+                'qrcode': f'data:image/svg+xml;base64,{img_str}',
                 'url': qr_content
             })
         else:
@@ -642,8 +735,8 @@ def change_password():
     user = api_client.get_user_by_id(user_id)
     
     if request.method == 'POST':
-        new_password = request.form.get('new_password', '').strip()
-        confirm_password = request.form.get('confirm_password', '').strip()
+        form = stripped_form(('new_password', 'confirm_password'))
+        new_password, confirm_password = form['new_password'], form['confirm_password']
         
         if not new_password or not confirm_password:
             return render_template('change_password.html', error='请填写所有必填项', is_first_login=user.is_first_login)
@@ -674,7 +767,6 @@ def change_password():
 @login_required
 def home():
     """手机端首页 - 显示我的借用、归还、转借、预约等基础操作"""
-    from datetime import datetime
     user = get_current_user()
 
     # 检查用户是否存在（可能已被删除）
@@ -682,11 +774,8 @@ def home():
         session.clear()
         return redirect(url_for('login'))
 
-    # 重新加载数据以获取最新数据
-    api_client.reload_data()
-
     # 获取所有设备
-    all_devices = api_client.get_all_devices()
+    all_devices = get_request_devices()
 
     # 获取我保管的设备数量
     my_custodian_devices = [d for d in all_devices if d.cabinet_number == user['borrower_name']]
@@ -695,6 +784,7 @@ def home():
     # 获取当前用户借用的设备，并计算剩余逾期时间
     raw_borrowed_devices = [d for d in all_devices if d.borrower == user['borrower_name'] and d.status != DeviceStatus.SHIPPED]
     my_borrowed_devices = []
+    now = g.now
     for device in raw_borrowed_devices:
         device.is_overdue = False
         device.overdue_days = 0
@@ -702,8 +792,7 @@ def home():
         device.can_renew = False
 
         if device.expected_return_date:
-            time_diff = device.expected_return_date - datetime.now()
-            total_seconds = time_diff.total_seconds()
+            total_seconds = (device.expected_return_date - now).total_seconds()
 
             if total_seconds < 0:
                 # 已逾期（只要过了预期归还时间就算逾期）
@@ -741,7 +830,6 @@ def home():
 
     # 筛选需要显示的预约
     active_reservations = []
-    now = datetime.now()
 
     for r in my_reservations:
         if r.status in ['待保管人确认', '待借用人确认', '待2人确认']:
@@ -775,7 +863,7 @@ def home():
                         'reserver_id': r.reserver_id,
                         'device_id': device.id,
                         'device_name': device.name,
-                        'device_type': get_device_type_str(device),
+                        'device_type': device.device_type_label,
                         'start_time': r.start_time,
                         'end_time': r.end_time,
                         'confirm_role': 'custodian',
@@ -795,7 +883,7 @@ def home():
                         'reserver_id': r.reserver_id,
                         'device_id': device.id,
                         'device_name': device.name,
-                        'device_type': get_device_type_str(device),
+                        'device_type': device.device_type_label,
                         'start_time': r.start_time,
                         'end_time': r.end_time,
                         'confirm_role': 'borrower',
@@ -819,11 +907,8 @@ def device_list():
     user = get_current_user()
     device_type = request.args.get('type', 'car')
 
-    # 重新加载数据
-    api_client.reload_data()
-
     # 获取所有设备
-    all_devices = api_client.get_all_devices()
+    all_devices = get_request_devices()
 
     # 根据类型筛选
     if device_type == 'car':
@@ -852,9 +937,6 @@ def device_detail(device_id):
     user = get_current_user()
     device_type = request.args.get('device_type', 'car')
 
-    # 重新加载数据
-    api_client.reload_data()
-
     # 获取设备详情
     device = api_client.get_device(device_id)
     if not device:
@@ -909,11 +991,7 @@ def add_remark(device_id):
 def edit_remark(remark_id):
     """编辑备注页面 - 直接重定向到PC端"""
     # 查找备注获取设备ID
-    remark = None
-    for r in api_client._remarks:
-        if r.id == remark_id:
-            remark = r
-            break
+    remark = api_client.get_remark_by_id(remark_id)
     if remark:
         return redirect(url_for('pc_device_detail', device_id=remark.device_id))
     return redirect(url_for('pc_device_list'))
@@ -926,14 +1004,8 @@ def my_records():
     user = get_current_user()
     filter_type = request.args.get('filter_type', 'all')
 
-    # 重新加载数据
-    api_client.reload_data()
-
-    # 获取所有记录
-    all_records = api_client.get_records()
-
-    # 筛选当前用户的记录
-    my_records_list = [r for r in all_records if r.borrower == user['borrower_name']]
+    # 获取当前用户的记录
+    my_records_list = api_client.get_records_by_borrower(user['borrower_name'])
 
     # 根据筛选类型过滤
     if filter_type == 'borrowed':
@@ -958,7 +1030,6 @@ def my_records():
 @login_required
 def pc_dashboard():
     """PC端首页仪表盘"""
-    from datetime import datetime
     user = get_current_user()
 
     # 检查用户是否存在（可能已被删除）
@@ -966,21 +1037,20 @@ def pc_dashboard():
         session.clear()
         return redirect(url_for('login'))
 
-    # 重新加载数据以获取最新Excel数据
-    api_client.reload_data()
-
     # 获取统计数据
-    all_devices = api_client.get_all_devices()
+    all_devices = get_request_devices()
     total_devices = len(all_devices)
-    available_devices = len([d for d in all_devices if d.status in [DeviceStatus.IN_STOCK, DeviceStatus.IN_CUSTODY, DeviceStatus.CIRCULATING, DeviceStatus.NO_CABINET]])
-    borrowed_devices_count = len([d for d in all_devices if d.status == DeviceStatus.BORROWED])
+    # 一次遍历统计各状态数量
+    status_counts = Counter(d.status for d in all_devices)
+    available_devices = sum(status_counts[s] for s in _AVAILABLE_STATUSES)
+    borrowed_devices_count = status_counts[DeviceStatus.BORROWED]
 
     # 详细状态统计
-    in_stock_count = len([d for d in all_devices if d.status == DeviceStatus.IN_STOCK])  # 在库
-    in_custody_count = len([d for d in all_devices if d.status == DeviceStatus.IN_CUSTODY])  # 保管中
-    no_cabinet_count = len([d for d in all_devices if d.status == DeviceStatus.NO_CABINET])  # 无柜号
-    circulating_count = len([d for d in all_devices if d.status == DeviceStatus.CIRCULATING])  # 流通
-    unavailable_count = len([d for d in all_devices if d.status in [DeviceStatus.LOST, DeviceStatus.DAMAGED, DeviceStatus.SHIPPED, DeviceStatus.SCRAPPED, DeviceStatus.SEALED]])  # 无法使用
+    in_stock_count = status_counts[DeviceStatus.IN_STOCK]  # 在库
+    in_custody_count = status_counts[DeviceStatus.IN_CUSTODY]  # 保管中
+    no_cabinet_count = status_counts[DeviceStatus.NO_CABINET]  # 无柜号
+    circulating_count = status_counts[DeviceStatus.CIRCULATING]  # 流通
+    unavailable_count = sum(status_counts[s] for s in _UNAVAILABLE_STATUSES)  # 无法使用
 
     # 获取我保管的设备
     my_custodian_devices = [d for d in all_devices if d.cabinet_number == user['borrower_name']]
@@ -990,6 +1060,8 @@ def pc_dashboard():
     # 排除已寄出状态的设备
     raw_borrowed_devices = [d for d in all_devices if d.borrower == user['borrower_name'] and d.status != DeviceStatus.SHIPPED]
     my_borrowed_devices = []
+    # 所有设备使用同一个当前时间（本次请求的 g.now）计算
+    now = g.now
     for device in raw_borrowed_devices:
         device.is_overdue = False
         device.overdue_days = 0
@@ -1003,15 +1075,15 @@ def pc_dashboard():
         device.renew_disabled_reason = ''
 
         if device.expected_return_date:
-            time_diff = device.expected_return_date - datetime.now()
-            total_seconds = time_diff.total_seconds()
+            total_seconds = (device.expected_return_date - now).total_seconds()
 
             if total_seconds < 0:
                 # 已逾期（只要过了预期归还时间就算逾期）
+                overdue_seconds = -total_seconds
                 device.is_overdue = True
-                device.overdue_hours = int(abs(total_seconds) // 3600)
-                device.overdue_days = int(abs(total_seconds) // (24 * 3600))
-                device.overdue_minutes = int(abs(total_seconds) // 60)
+                device.overdue_hours = int(overdue_seconds // 3600)
+                device.overdue_days = int(overdue_seconds // (24 * 3600))
+                device.overdue_minutes = int(overdue_seconds // 60)
                 # 逾期超过3天不能续借
                 if device.overdue_days > 3:
                     device.can_renew = False
@@ -1071,7 +1143,6 @@ def pc_dashboard():
     my_borrowed_count = len(my_borrowed_devices)
 
     # 获取我的预约
-    from datetime import datetime
     my_reservations = api_client.get_user_reservations(user['user_id'])
     
     # 筛选需要显示的预约：
@@ -1080,7 +1151,6 @@ def pc_dashboard():
     # 3. 已拒绝的预约（保留显示到预约开始时间，但如果该设备有更新状态的预约记录则隐藏）
     # 4. 已取消的预约（不显示）
     active_reservations = []
-    now = datetime.now()
     
     # 按设备ID分组，找出每个设备最新的预约记录时间
     device_latest_reservation_time = {}
@@ -1314,7 +1384,7 @@ def pc_dashboard():
                         'reserver_id': r.reserver_id,
                         'device_id': device.id,
                         'device_name': device.name,
-                        'device_type': get_device_type_str(device),
+                        'device_type': device.device_type_label,
                         'start_time': r.start_time.strftime('%m-%d %H:%M') if r.start_time else '',
                         'end_time': r.end_time.strftime('%m-%d %H:%M') if r.end_time else '',
                         'confirm_role': 'custodian',
@@ -1335,7 +1405,7 @@ def pc_dashboard():
                         'reserver_id': r.reserver_id,
                         'device_id': device.id,
                         'device_name': device.name,
-                        'device_type': get_device_type_str(device),
+                        'device_type': device.device_type_label,
                         'start_time': r.start_time.strftime('%m-%d %H:%M') if r.start_time else '',
                         'end_time': r.end_time.strftime('%m-%d %H:%M') if r.end_time else '',
                         'confirm_role': 'borrower',
@@ -1435,8 +1505,7 @@ def pc_dashboard():
 @login_required
 def api_get_all_devices():
     """获取所有设备数据（用于全局搜索）"""
-    api_client.reload_data()
-    devices = api_client.get_all_devices()
+    devices = get_request_devices()
     
     device_list = []
     for device in devices:
@@ -1463,13 +1532,23 @@ def api_get_all_devices():
     })
 
 
+# 使用保管人的设备类型（手机、手机卡、其它设备）
+_CUSTODIAN_DEVICE_TYPES = (DeviceType.PHONE, DeviceType.SIM_CARD, DeviceType.OTHER_DEVICE)
+
+
+def _is_no_cabinet_device(device):
+    """判断设备是否无柜号/无保管人"""
+    if device.device_type in _CUSTODIAN_DEVICE_TYPES:
+        # 手机、手机卡、其它设备：根据custodian_id判断是否有保管人
+        return not device.custodian_id or device.custodian_id.strip() == ''
+    # 车机、仪表：根据status判断是否为无柜号状态
+    return device.status == DeviceStatus.NO_CABINET
+
+
 @app.route('/pc/devices')
 @login_required
 def pc_device_list():
     """PC端设备列表页面"""
-    # 重新加载数据以获取最新Excel数据
-    api_client.reload_data()
-
     user = get_current_user()
     device_type = request.args.get('type', 'all')
     status = request.args.get('status', 'all')
@@ -1487,25 +1566,25 @@ def pc_device_list():
 
     # 获取设备
     if device_type == 'all':
-        devices = api_client.get_all_devices()  # 获取所有设备
+        devices = get_request_devices()  # 获取所有设备
         title = '全部设备'
     elif device_type == 'car':
-        devices = api_client.get_all_devices('车机')
+        devices = get_request_devices('车机')
         title = '车机设备'
     elif device_type == 'phone':
-        devices = api_client.get_all_devices('手机')
+        devices = get_request_devices('手机')
         title = '手机设备'
     elif device_type == 'instrument':
-        devices = api_client.get_all_devices('仪表')
+        devices = get_request_devices('仪表')
         title = '仪表设备'
     elif device_type == 'simcard':
-        devices = api_client.get_all_devices('手机卡')
+        devices = get_request_devices('手机卡')
         title = '手机卡设备'
     elif device_type == 'other':
-        devices = api_client.get_all_devices('其它设备')
+        devices = get_request_devices('其它设备')
         title = '其它设备'
     else:
-        devices = api_client.get_all_devices('车机')
+        devices = get_request_devices('车机')
         title = '车机设备'
 
     # 状态过滤
@@ -1519,42 +1598,7 @@ def pc_device_list():
     if search:
         # 移除搜索词中的所有空格
         search_normalized = search.lower().replace(' ', '').replace('\t', '').replace('\n', '')
-        filtered_devices = []
-        for d in devices:
-            # 基础字段搜索（移除空格后匹配）
-            match = (search_normalized in d.name.lower().replace(' ', '') or
-                     search_normalized in (d.model or '').lower().replace(' ', '') or
-                     search_normalized in (d.borrower or '').lower().replace(' ', '') or
-                     search_normalized in (d.jira_address or '').lower().replace(' ', '') or
-                     search_normalized in (d.remark or '').lower().replace(' ', '') or
-                     search_normalized in d.status.value.lower().replace(' ', '') or
-                     search_normalized in d.device_type.value.lower().replace(' ', ''))
-
-            # 车机/仪表特有字段
-            if not match and d.device_type.value in ['车机', '仪表']:
-                match = (search_normalized in (d.project_attribute or '').lower().replace(' ', '') or
-                         search_normalized in (d.connection_method or '').lower().replace(' ', '') or
-                         search_normalized in (d.os_version or '').lower().replace(' ', '') or
-                         search_normalized in (d.os_platform or '').lower().replace(' ', '') or
-                         search_normalized in (d.product_name or '').lower().replace(' ', '') or
-                         search_normalized in (d.screen_orientation or '').lower().replace(' ', '') or
-                         search_normalized in (d.screen_resolution or '').lower().replace(' ', '') or
-                         search_normalized in (d.hardware_version or '').lower().replace(' ', ''))
-
-            # 手机特有字段
-            if not match and d.device_type.value == '手机':
-                match = (search_normalized in (d.system_version or '').lower().replace(' ', '') or
-                         search_normalized in (d.imei or '').lower().replace(' ', '') or
-                         search_normalized in (d.sn or '').lower().replace(' ', '') or
-                         search_normalized in (d.carrier or '').lower().replace(' ', ''))
-
-            # 手机卡特有字段
-            if not match and d.device_type.value == '手机卡':
-                match = search_normalized in (d.carrier or '').lower().replace(' ', '')
-
-            if match:
-                filtered_devices.append(d)
-        devices = filtered_devices
+        devices = [d for d in devices if search_normalized in get_device_search_text(d)]
 
     # 级联筛选：计算每个下拉框的可用选项（基于其他筛选条件，不包括自己）
     if device_type in ['car', 'instrument']:
@@ -1709,43 +1753,27 @@ def pc_device_list():
         if filter_resolution:
             devices = [d for d in devices if filter_resolution in (d.screen_resolution or '')]
 
-    # 处理设备列表，添加 no_cabinet 和 is_circulating 属性
-    device_list = []
-    for device in devices:
-        is_circulating = device.status == DeviceStatus.CIRCULATING
-        is_sealed = device.status == DeviceStatus.SEALED
-        
-        # 判断是否为使用保管人的设备类型（手机、手机卡、其它设备）
-        is_custodian_type = device.device_type in [DeviceType.PHONE, DeviceType.SIM_CARD, DeviceType.OTHER_DEVICE]
-
-        if is_custodian_type:
-            # 手机、手机卡、其它设备：根据custodian_id判断是否有保管人
-            is_no_cabinet = not device.custodian_id or device.custodian_id.strip() == ''
-        else:
-            # 车机、仪表：根据status判断是否为无柜号状态
-            is_no_cabinet = device.status == DeviceStatus.NO_CABINET
-
-        # 如果是无柜号筛选，只显示柜号/保管人为空的设备
-        if no_cabinet == '1':
-            if not is_no_cabinet:
-                continue
-
-        # 直接给设备对象添加额外属性
-        device.no_cabinet = is_no_cabinet
-        device.is_circulating = is_circulating
-        device.is_sealed = is_sealed
-        device.is_custodian_type = is_custodian_type
-        device_list.append(device)
+    # 如果是无柜号筛选，只显示柜号/保管人为空的设备
+    if no_cabinet == '1':
+        devices = [d for d in devices if _is_no_cabinet_device(d)]
 
     # 分页
     page = request.args.get('page', 1, type=int)
     per_page = 20
-    total = len(device_list)
+    total = len(devices)
     total_pages = (total + per_page - 1) // per_page
 
-    start = (page - 1) * per_page
+    start = max((page - 1) * per_page, 0)
     end = start + per_page
-    paginated_devices = device_list[start:end]
+
+    # 只为当前页的设备添加 no_cabinet 和 is_circulating 等显示属性
+    paginated_devices = []
+    for device in islice(devices, start, end):
+        device.no_cabinet = _is_no_cabinet_device(device)
+        device.is_circulating = device.status == DeviceStatus.CIRCULATING
+        device.is_sealed = device.status == DeviceStatus.SEALED
+        device.is_custodian_type = device.device_type in _CUSTODIAN_DEVICE_TYPES
+        paginated_devices.append(device)
     
     # 获取全局统计（用于侧边栏显示）
     stats = get_device_stats()
@@ -1792,8 +1820,6 @@ def pc_device_list():
 def pc_device_detail(device_id):
     """PC端设备详情页面"""
     user = get_current_user()
-    # 重新加载数据以获取最新Excel数据
-    api_client.reload_data()
 
     # 获取设备类型参数，用于区分不同类型设备的相同ID
     device_type_param = request.args.get('device_type')
@@ -1801,11 +1827,7 @@ def pc_device_detail(device_id):
     # 先尝试根据设备类型查询
     device = None
     if device_type_param:
-        devices = api_client.get_all_devices(device_type_param)
-        for d in devices:
-            if d.id == device_id and not d.is_deleted:
-                device = d
-                break
+        device = api_client.get_device_by_id(device_id, device_type_param)
 
     # 如果没找到，使用默认查找方式
     if not device:
@@ -1815,7 +1837,7 @@ def pc_device_detail(device_id):
         return render_template('error.html', message='设备不存在'), 404
 
     # 获取设备类型字符串
-    device_type = get_device_type_str(device)
+    device_type = device.device_type_label
 
     # 添加查看记录
     if user['borrower_name']:
@@ -1879,8 +1901,9 @@ def pc_device_detail(device_id):
     is_long_term_borrow = False  # 是否为长期借用
 
     # 计算剩余时间（无论设备状态如何，只要有预计归还日期）
+    now = g.now
     if device.expected_return_date:
-        time_diff = datetime.now() - device.expected_return_date
+        time_diff = now - device.expected_return_date
         total_seconds = time_diff.total_seconds()
         if total_seconds > 0:  # 已逾期（只要过了预期归还时间就算逾期）
             is_overdue = True
@@ -1966,7 +1989,7 @@ def pc_device_detail(device_id):
                          remaining_minutes=remaining_minutes,
                          is_long_term_borrow=is_long_term_borrow,
                          user=user,
-                         now=datetime.now().strftime('%Y-%m-%d %H:%M'),
+                         now=now.strftime('%Y-%m-%d %H:%M'),
                          device_images=device_images,
                          device_attachments=device_attachments,
                          borrower_info=borrower_info,
@@ -1979,20 +2002,13 @@ def pc_device_detail(device_id):
 @login_required
 def pc_device_detail_simple(device_id):
     """PC端设备详情页面（简化版） 用于借还确认"""
-    # 重新加载数据以获取最新Excel数据
-    api_client.reload_data()
-
     # 获取设备类型参数，用于区分不同类型设备的相同ID
     device_type_param = request.args.get('device_type')
 
     # 先尝试根据设备类型查询
     device = None
     if device_type_param:
-        devices = api_client.get_all_devices(device_type_param)
-        for d in devices:
-            if d.id == device_id and not d.is_deleted:
-                device = d
-                break
+        device = api_client.get_device_by_id(device_id, device_type_param)
 
     # 如果没找到，使用默认查找方式
     if not device:
@@ -2004,7 +2020,7 @@ def pc_device_detail_simple(device_id):
     action = request.args.get('action', 'view')
 
     # 获取设备类型
-    device_type = get_device_type_str(device)
+    device_type = device.device_type_label
 
     # 判断设备状态
     is_circulating = device.status == DeviceStatus.CIRCULATING
@@ -2044,12 +2060,10 @@ def pc_device_detail_simple(device_id):
 @login_required
 def pc_my_custodian_devices():
     """PC端我的保管设备"""
-    from datetime import datetime
-    api_client.reload_data()
     user = get_current_user()
     
     # 获取当前用户保管的设备（cabinet_number等于用户名称）
-    all_devices = api_client.get_all_devices()
+    all_devices = get_request_devices()
     custodian_devices = []
     
     for device in all_devices:
@@ -2065,7 +2079,7 @@ def pc_my_custodian_devices():
             
             if device.expected_return_date:
                 expected_return_str = device.expected_return_date.strftime('%Y-%m-%d %H:%M')
-                now = datetime.now()
+                now = g.now
                 time_diff = device.expected_return_date - now
                 
                 if time_diff.total_seconds() > 0:
@@ -2095,7 +2109,7 @@ def pc_my_custodian_devices():
             custodian_devices.append({
                 'id': device.id,
                 'name': device.name,
-                'type': get_device_type_str(device),
+                'type': device.device_type_label,
                 'borrower': device.borrower or '未借用',
                 'status': device.status.value,
                 'borrow_time': borrow_time_str,
@@ -2118,58 +2132,23 @@ def pc_my_custodian_devices():
 @login_required
 def pc_records():
     """PC端个人记录页面"""
-    # 重新加载数据以获取最新Excel数据
-    api_client.reload_data()
-
     user = get_current_user()
 
-    # 获取当前用户的记录
-    my_records_list = []
-    all_records = api_client.get_records()
-
-    for record in all_records:
-        should_include = False
-
-        # 原有的条件：用户名在 borrower 中，或用户是操作人
-        if user['borrower_name'] in record.borrower or record.operator == user['borrower_name'] or record.borrower == user['borrower_name']:
-            should_include = True
-
-        # 检查管理员操作是否与当前用户相关
-        if not should_include:
-            # 状态变更记录：如果借用人是当前用户
-            if '状态变更' in record.operation_type.value and record.borrower == user['borrower_name']:
-                should_include = True
-            # 保管人变更记录：检查 reason 或 remark 中是否包含用户名
-            elif '保管人变更' in record.operation_type.value:
-                if user['borrower_name'] in record.reason:
-                    should_include = True
-                elif record.remark and user['borrower_name'] in record.remark:
-                    should_include = True
-            # 其他管理员操作：如果借用人是当前用户
-            elif record.borrower == user['borrower_name']:
-                should_include = True
-
-        if should_include:
-            my_records_list.append(record)
-
-    # 分页
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    total = len(my_records_list)
-    total_pages = (total + per_page - 1) // per_page
-
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_records = my_records_list[start:end]
+    # 获取当前用户的记录（数据库分页）：借用人包含用户名、用户为操作人，或 reason/remark 中提及用户的保管人变更记录
+    result = api_client.get_records_paginated(
+        page=request.args.get('page', 1, type=int),
+        per_page=20,
+        borrower_name=user['borrower_name']
+    )
+    paginated_records = result['records']
+    total = result['total']
+    page = result['page']
+    total_pages = result['total_pages']
 
     # 统计 - 使用用户表中的 borrow_count 和 return_count，与排行榜保持一致
-    borrow_count = 0
-    return_count = 0
-    for u in api_client._users:
-        if u.id == user['user_id']:
-            borrow_count = u.borrow_count
-            return_count = u.return_count
-            break
+    full_user = api_client.get_user_by_id(user['user_id'])
+    borrow_count = full_user.borrow_count if full_user else 0
+    return_count = full_user.return_count if full_user else 0
 
     stats = get_device_stats()
 
@@ -2185,30 +2164,27 @@ def pc_records():
                          **stats)
 
 
+# 记录统计时计为借用/归还的操作类型
+_BORROW_OPERATION_TYPES = frozenset((OperationType.BORROW, OperationType.FORCE_BORROW, OperationType.TRANSFER))
+_RETURN_OPERATION_TYPES = frozenset((OperationType.RETURN, OperationType.FORCE_RETURN))
+
+
 @app.route('/pc/all-records')
 @login_required
 def pc_all_records():
     """PC端所有记录页面"""
-    # 重新加载数据以获取最新Excel数据
-    api_client.reload_data()
-
-    # 获取所有记录
-    all_records_list = api_client.get_records()
-    
     # 统计借用和归还次数（借出+转借都算作借用，归还+强制归还都算作归还）
-    borrow_count = len([r for r in all_records_list if '借出' in r.operation_type.value or r.operation_type.value == '转借'])
-    return_count = len([r for r in all_records_list if r.operation_type.value in ['归还', '强制归还']])
-    
-    # 分页
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    total = len(all_records_list)
-    total_pages = (total + per_page - 1) // per_page
-    
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_records = all_records_list[start:end]
-    
+    type_counts = api_client.count_records_by_operation_type()
+    borrow_count = sum(type_counts.get(t.value, 0) for t in _BORROW_OPERATION_TYPES)
+    return_count = sum(type_counts.get(t.value, 0) for t in _RETURN_OPERATION_TYPES)
+
+    # 分页（数据库分页，只取当前页记录）
+    result = api_client.get_records_paginated(page=request.args.get('page', 1, type=int), per_page=20)
+    paginated_records = result['records']
+    total = result['total']
+    page = result['page']
+    total_pages = result['total_pages']
+
     stats = get_device_stats()
     
     user = get_current_user()
@@ -2240,12 +2216,29 @@ def pc_user_rankings():
 
 # ==================== API 接口 ====================
 
+def device_locked(f):
+    """持有请求中 device_id 对应设备的锁（api_client.device_lock）执行整个接口
+
+    用于未使用 device_mutation 的设备状态变更接口，串行化同一设备的校验-修改-保存，
+    避免并发请求都通过状态校验（如同一台在库设备被两人同时借出）
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        data = request.get_json(cache=True, silent=True) or {}
+        with api_client.device_lock(data.get('device_id')):
+            return f(*args, **kwargs)
+    return decorated_function
+
+
 @app.route('/api/borrow', methods=['POST'])
 @login_required
+@device_locked
 def api_borrow():
     """借用设备API"""
     user = get_current_user()
-    data = request.json
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({'success': False, 'message': '请求数据格式错误'})
     
     device_id = data.get('device_id')
     location = data.get('location', '').strip()
@@ -2257,9 +2250,6 @@ def api_borrow():
     if not reason:
         return jsonify({'success': False, 'message': '请输入借用原因'})
     
-    # 重新加载数据以获取最新状态
-    api_client.reload_data()
-    
     device = api_client.get_device_by_id(device_id)
     if not device:
         return jsonify({'success': False, 'message': '设备不存在'})
@@ -2271,11 +2261,7 @@ def api_borrow():
     original_borrower = device.borrower if device.status == DeviceStatus.BORROWED else None
     
     # 检查用户借用数量限制
-    user_borrowed_count = 0
-    all_devices = api_client.get_all_devices()
-    for d in all_devices:
-        if d.borrower == user['borrower_name'] and d.status == DeviceStatus.BORROWED:
-            user_borrowed_count += 1
+    user_borrowed_count = api_client.count_borrowed_devices(user['borrower_name'])
 
     borrow_limit = 10  # 最大借用数量（车机+手机卡）
     if user_borrowed_count >= borrow_limit:
@@ -2284,8 +2270,11 @@ def api_borrow():
     # 获取用户邮箱（替代原来的手机号）
     user_email = user.get('email', '')
     
+    # 本次借用统一使用同一个当前时间（借用开始、借用时间、记录时间）
+    now = g.now
+
     # 计算预计归还时间
-    borrow_start_time = datetime.now()
+    borrow_start_time = now
     if expected_return_date:
         # 使用前端传递的完整日期时间
         from datetime import datetime as dt
@@ -2295,8 +2284,7 @@ def api_borrow():
         except ValueError:
             # 兼容旧格式 YYYY-MM-DD，时间设为当前时间
             date_part = dt.strptime(expected_return_date, '%Y-%m-%d')
-            now_time = dt.now()
-            device.expected_return_date = date_part.replace(hour=now_time.hour, minute=now_time.minute, second=now_time.second)
+            device.expected_return_date = date_part.replace(hour=now.hour, minute=now.minute, second=now.second)
     else:
         # 长期借用，不设置归还日期（空字符串或None都表示长期借用）
         device.expected_return_date = None
@@ -2304,7 +2292,7 @@ def api_borrow():
     # 检查是否有预约冲突（只检查与预约时间重合的情况，自己的预约不视为冲突）
     has_conflict, conflict_info = api_client.check_reservation_conflict(
         device_id=device_id,
-        device_type=get_device_type_str(device),
+        device_type=device.device_type_label,
         start_time=borrow_start_time,
         end_time=device.expected_return_date,
         current_user_id=user['user_id']
@@ -2318,16 +2306,15 @@ def api_borrow():
             })
     
     # 更新设备信息
-    device.status = DeviceStatus.BORROWED
-    device.borrower = user['borrower_name']
-    device.borrower_id = user['user_id']  # 设置借用人ID
-    device.borrow_time = datetime.now()
-    device.location = location
-    device.reason = reason
-    device.entry_source = EntrySource.USER.value
-    device.previous_borrower = ''  # 清空上一个借用人，因为从在库借用
-    
-    api_client.update_device(device, source="user")
+    with api_client.device_txn(device, source="user"):
+        device.status = DeviceStatus.BORROWED
+        device.borrower = user['borrower_name']
+        device.borrower_id = user['user_id']  # 设置借用人ID
+        device.borrow_time = now
+        device.location = location
+        device.reason = reason
+        device.entry_source = EntrySource.USER.value
+        device.previous_borrower = ''  # 清空上一个借用人，因为从在库借用
     
     # 解析原因和备注（格式：原因 - 详细说明）
     reason_parts = reason.split(' - ', 1)
@@ -2335,27 +2322,14 @@ def api_borrow():
     remark_text = reason_parts[1] if len(reason_parts) > 1 else ''
     
     # 添加记录
-    record = Record(
-        id=str(uuid.uuid4()),
-        device_id=device.id,
-        device_name=device.name,
-        device_type=get_device_type_str(device),
-        operation_type=OperationType.BORROW,
-        operator=user['borrower_name'],
-        operation_time=datetime.now(),
-        borrower=user['borrower_name'],
-        reason=reason_main,
-        remark=remark_text,
-        entry_source=EntrySource.USER.value
-    )
-    api_client._db.save_record(record)
+    save_user_record(device, user, OperationType.BORROW, user['borrower_name'], reason_main,
+                     remark=remark_text, operation_time=now)
     
     # 更新用户借用次数
-    for u in api_client._users:
-        if u.id == user['user_id']:
-            u.borrow_count += 1
-            api_client._db.save_user(u)
-            break
+    borrower_user = api_client.get_user_by_id(user['user_id'])
+    if borrower_user:
+        borrower_user.borrow_count += 1
+        api_client._db.save_user(borrower_user)
 
     api_client.add_operation_log(f"借出设备: {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
 
@@ -2369,11 +2343,7 @@ def api_borrow():
     # 发送通知（用户自己借设备，不需要通知自己）
     # 1. 通知原借用人（如果设备之前被借用且原借用人不是自己）
     if original_borrower and original_borrower != user['borrower_name']:
-        original_user = None
-        for u in api_client._users:
-            if u.borrower_name == original_borrower:
-                original_user = u
-                break
+        original_user = api_client.get_user_by_borrower_name(original_borrower)
         if original_user:
             api_client.add_notification(
                 user_id=original_user.id,
@@ -2386,11 +2356,7 @@ def api_borrow():
             )
     # 2. 通知保管人（如果保管人不是借用人自己）
     if device.cabinet_number and device.cabinet_number != user['borrower_name']:
-        custodian_user = None
-        for u in api_client._users:
-            if u.borrower_name == device.cabinet_number:
-                custodian_user = u
-                break
+        custodian_user = api_client.get_user_by_borrower_name(device.cabinet_number)
         if custodian_user:
             api_client.add_notification(
                 user_id=custodian_user.id,
@@ -2412,14 +2378,12 @@ def api_borrow():
 
 @app.route('/api/return', methods=['POST'])
 @login_required
+@device_locked
 def api_return():
     """归还设备API"""
     user = get_current_user()
     data = request.json
     
-    # 重新加载数据以获取最新状态
-    api_client.reload_data()
-    
     device_id = data.get('device_id')
     return_location = data.get('return_location', '').strip() or '设备柜'
     return_reason = data.get('return_reason', '').strip() or data.get('reason', '').strip()
@@ -2445,22 +2409,21 @@ def api_return():
     
     original_borrower = device.borrower
 
-    # 根据设备类型设置归还后的状态
-    # 手机、手机卡、其它设备 -> 保管中；车机、仪表 -> 在库
-    if device.device_type in [DeviceType.PHONE, DeviceType.SIM_CARD, DeviceType.OTHER_DEVICE]:
-        device.status = DeviceStatus.IN_CUSTODY
-    else:
-        device.status = DeviceStatus.IN_STOCK
+    with api_client.device_txn(device, source="user"):
+        # 根据设备类型设置归还后的状态
+        # 手机、手机卡、其它设备 -> 保管中；车机、仪表 -> 在库
+        if device.device_type in [DeviceType.PHONE, DeviceType.SIM_CARD, DeviceType.OTHER_DEVICE]:
+            device.status = DeviceStatus.IN_CUSTODY
+        else:
+            device.status = DeviceStatus.IN_STOCK
 
-    device.borrower = ''
-    device.phone = ''
-    device.borrow_time = None
-    device.location = return_location
-    device.reason = return_reason
-    device.entry_source = ''
-    device.expected_return_date = None
-    
-    api_client.update_device(device, source="user")
+        device.borrower = ''
+        device.phone = ''
+        device.borrow_time = None
+        device.location = return_location
+        device.reason = return_reason
+        device.entry_source = ''
+        device.expected_return_date = None
     
     # 解析归还原因和备注（格式：原因 - 备注）
     reason_parts = return_reason.split(' - ', 1)
@@ -2468,46 +2431,25 @@ def api_return():
     remark_text = reason_parts[1] if len(reason_parts) > 1 else ''
     
     # 添加记录
-    record = Record(
-        id=str(uuid.uuid4()),
-        device_id=device.id,
-        device_name=device.name,
-        device_type=get_device_type_str(device),
-        operation_type=OperationType.RETURN,
-        operator=user['borrower_name'],
-        operation_time=datetime.now(),
-        borrower=original_borrower,
-        reason=reason_main,
-        remark=remark_text,
-        entry_source=EntrySource.USER.value
-    )
-    api_client._db.save_record(record)
-
-    api_client.add_operation_log(f"归还设备: {original_borrower}", device.name, operator=user['borrower_name'], source="user")
+    save_user_record(device, user, OperationType.RETURN, original_borrower, reason_main,
+                     f"归还设备: {original_borrower}", remark=remark_text)
     
     # 更新原借用人的归还次数
-    for u in api_client._users:
-        if u.borrower_name == original_borrower:
-            u.return_count += 1
-            api_client._db.save_user(u)
-            break
+    original_user = api_client.get_user_by_borrower_name(original_borrower)
+    if original_user:
+        original_user.return_count += 1
+        api_client._db.save_user(original_user)
     
     # 归还成功，奖励积分（给原借用人）
     points_message = ""
-    # 查找原借用人的用户ID
-    original_borrower_user_id = None
-    for u in api_client._users:
-        if u.borrower_name == original_borrower:
-            original_borrower_user_id = u.id
-            break
+    # 原借用人的用户ID
+    original_borrower_user_id = original_user.id if original_user else None
     
     if original_borrower_user_id:
         # 检查是否逾期
         is_overdue = False
         if device.expected_return_date:
-            from datetime import datetime as dt
-            now = dt.now()
-            if now > device.expected_return_date:
+            if g.now > device.expected_return_date:
                 # 只要过了预期归还时间就算逾期
                 is_overdue = True
         
@@ -2527,13 +2469,13 @@ def api_return():
     points_change = points_result.get('points_change', 0) if points_result.get('success') else 0
 
     # 检查是否有等待的预约，通知第一个等待的预约人
-    device_type = get_device_type_str(device)
+    device_type = device.device_type_label
     waiting_reservations = api_client._db.get_reservations_by_device(device_id, device_type)
     notified_reserver = None
     for reservation in waiting_reservations:
         # 只通知已同意且预约开始时间在未来或现在的预约
         if (reservation.status == ReservationStatus.APPROVED.value and
-            reservation.start_time <= datetime.now() + timedelta(days=1)):  # 预约时间在现在或明天内
+            reservation.start_time <= g.now + timedelta(days=1)):  # 预约时间在现在或明天内
             api_client.add_notification(
                 user_id=reservation.reserver_id,
                 user_name=reservation.reserver_name,
@@ -2552,11 +2494,7 @@ def api_return():
     # - 保管人归还：不需要通知（自己操作的）
     # - 无需通知原借用人（设备已归还，与原借用人无关了）
     if is_borrower and device.cabinet_number and device.cabinet_number != user['borrower_name']:
-        custodian_user = None
-        for u in api_client._users:
-            if u.borrower_name == device.cabinet_number:
-                custodian_user = u
-                break
+        custodian_user = api_client.get_user_by_borrower_name(device.cabinet_number)
         if custodian_user:
             content = f"您保管的设备「{device.name}」已被 {user['borrower_name']} 归还"
             if notified_reserver:
@@ -2597,7 +2535,7 @@ def api_add_remark():
         return jsonify({'success': False, 'message': '设备不存在'})
 
     # 获取设备类型
-    device_type = get_device_type_str(device)
+    device_type = device.device_type_label
 
     # 创建备注
     remark = UserRemark(
@@ -2606,7 +2544,7 @@ def api_add_remark():
         device_type=device_type,
         content=content,
         creator=user['borrower_name'],
-        create_time=datetime.now()
+        create_time=g.now
     )
     api_client._db.save_remark(remark)
 
@@ -2624,7 +2562,7 @@ def _approve_my_reservation(api_client, reservation, user):
     if reservation.status == ReservationStatus.APPROVED.value:
         return
     
-    now = datetime.now()
+    now = g.now
     
     # 自动作为借用人同意
     if not reservation.borrower_approved:
@@ -2646,14 +2584,12 @@ def _approve_my_reservation(api_client, reservation, user):
 
 @app.route('/api/transfer-to-me', methods=['POST'])
 @login_required
+@device_locked
 def api_transfer_to_me():
     """转给自己API（用于遗失找回）"""
     user = get_current_user()
     data = request.json
     
-    # 重新加载数据以获取最新状态
-    api_client.reload_data()
-    
     device_id = data.get('device_id')
     device = api_client.get_device_by_id(device_id)
     
@@ -2665,11 +2601,7 @@ def api_transfer_to_me():
         return jsonify({'success': False, 'message': '设备状态异常，无法操作'})
     
     # 检查用户借用数量限制
-    user_borrowed_count = 0
-    all_devices = api_client.get_all_devices()
-    for d in all_devices:
-        if d.borrower == user['borrower_name'] and d.status == DeviceStatus.BORROWED:
-            user_borrowed_count += 1
+    user_borrowed_count = api_client.count_borrowed_devices(user['borrower_name'])
     
     borrow_limit = 10  # 最大借用数量（车机+手机卡）
     if user_borrowed_count >= borrow_limit:
@@ -2730,50 +2662,33 @@ def api_transfer_to_me():
         # 自动同意自己的预约
         _approve_my_reservation(api_client, my_reservation, user)
     else:
-        expected_return = datetime.now() + timedelta(days=1)
+        expected_return = g.now + timedelta(days=1)
     
     # 更新设备信息 - 转给自己
-    device.previous_borrower = original_borrower
-    device.borrower = user['borrower_name']
-    device.status = DeviceStatus.BORROWED
-    device.lost_time = None  # 清除丢失时间
-    device.entry_source = EntrySource.USER.value
-    device.expected_return_date = expected_return  # 使用预约结束时间或默认1天
-    
-    api_client.update_device(device, source="user")
+    with api_client.device_txn(device, source="user"):
+        device.previous_borrower = original_borrower
+        device.borrower = user['borrower_name']
+        device.status = DeviceStatus.BORROWED
+        device.lost_time = None  # 清除丢失时间
+        device.entry_source = EntrySource.USER.value
+        device.expected_return_date = expected_return  # 使用预约结束时间或默认1天
     
     # 添加记录
-    record = Record(
-        id=str(uuid.uuid4()),
-        device_id=device.id,
-        device_name=device.name,
-        device_type=get_device_type_str(device),
-        operation_type=OperationType.TRANSFER,
-        operator=user['borrower_name'],
-        operation_time=datetime.now(),
-        borrower=f"被转借：{original_borrower}——>{user['borrower_name']}",
-        reason='用户转借给自己',
-        entry_source=EntrySource.USER.value
-    )
-    api_client._db.save_record(record)
+    save_user_record(device, user, OperationType.TRANSFER,
+                     f"被转借：{original_borrower}——>{user['borrower_name']}", '用户转借给自己')
     
     # 给自己增加借用次数
-    for u in api_client._users:
-        if u.borrower_name == user['borrower_name']:
-            u.borrow_count += 1
-            api_client._db.save_user(u)
-            break
+    borrower_user = api_client.get_user_by_id(user['user_id'])
+    if borrower_user:
+        borrower_user.borrow_count += 1
+        api_client._db.save_user(borrower_user)
 
     api_client.add_operation_log(f"转给自己: {original_borrower} -> {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
     
     
     # 通知原借用人（如果存在且不是当前用户）
     if original_borrower and original_borrower != user['borrower_name']:
-        original_user = None
-        for u in api_client._users:
-            if u.borrower_name == original_borrower:
-                original_user = u
-                break
+        original_user = api_client.get_user_by_borrower_name(original_borrower)
         if original_user:
             api_client.add_notification(
                 user_id=original_user.id,
@@ -2787,11 +2702,7 @@ def api_transfer_to_me():
     
     # 通知保管人（如果存在且不是相关人）
     if device.cabinet_number and device.cabinet_number != original_borrower and device.cabinet_number != user['borrower_name']:
-        custodian_user = None
-        for u in api_client._users:
-            if u.borrower_name == device.cabinet_number:
-                custodian_user = u
-                break
+        custodian_user = api_client.get_user_by_borrower_name(device.cabinet_number)
         if custodian_user:
             api_client.add_notification(
                 user_id=custodian_user.id,
@@ -2820,14 +2731,12 @@ def api_transfer_to_me():
 
 @app.route('/api/return-by-custodian', methods=['POST'])
 @login_required
+@device_locked
 def api_return_by_custodian():
     """保管人代还API"""
     user = get_current_user()
     data = request.json
     
-    # 重新加载数据以获取最新状态
-    api_client.reload_data()
-    
     device_id = data.get('device_id')
     device = api_client.get_device_by_id(device_id)
     
@@ -2844,47 +2753,32 @@ def api_return_by_custodian():
     
     original_borrower = device.borrower
 
-    # 根据设备类型设置归还后的状态
-    # 手机、手机卡、其它设备 -> 保管中；车机、仪表 -> 在库
-    if device.device_type in [DeviceType.PHONE, DeviceType.SIM_CARD, DeviceType.OTHER_DEVICE]:
-        device.status = DeviceStatus.IN_CUSTODY
-    else:
-        device.status = DeviceStatus.IN_STOCK
-
-    device.borrower = ''
-    device.phone = ''
-    device.borrow_time = None
-    device.location = ''
-    device.reason = ''
-    device.entry_source = ''
-    device.expected_return_date = None
-    device.lost_time = None
+    with api_client.device_txn(device, source="user"):
+        # 根据设备类型设置归还后的状态
+        # 手机、手机卡、其它设备 -> 保管中；车机、仪表 -> 在库
+        if device.device_type in [DeviceType.PHONE, DeviceType.SIM_CARD, DeviceType.OTHER_DEVICE]:
+            device.status = DeviceStatus.IN_CUSTODY
+        else:
+            device.status = DeviceStatus.IN_STOCK
 
-    api_client.update_device(device, source="user")
+        device.borrower = ''
+        device.phone = ''
+        device.borrow_time = None
+        device.location = ''
+        device.reason = ''
+        device.entry_source = ''
+        device.expected_return_date = None
+        device.lost_time = None
 
     # 添加记录
-    record = Record(
-        id=str(uuid.uuid4()),
-        device_id=device.id,
-        device_name=device.name,
-        device_type=get_device_type_str(device),
-        operation_type=OperationType.RETURN,
-        operator=user['borrower_name'],
-        operation_time=datetime.now(),
-        borrower=f"保管人代还：{original_borrower}",
-        reason='保管人代还设备',
-        entry_source=EntrySource.USER.value
-    )
-    api_client._db.save_record(record)
-
-    api_client.add_operation_log(f"保管人代还 {original_borrower}", device.name, operator=user['borrower_name'], source="user")
+    save_user_record(device, user, OperationType.RETURN, f"保管人代还：{original_borrower}", '保管人代还设备',
+                     f"保管人代还 {original_borrower}")
     
     # 更新原借用人的归还次数
-    for u in api_client._users:
-        if u.borrower_name == original_borrower:
-            u.return_count += 1
-            api_client._db.save_user(u)
-            break
+    original_user = api_client.get_user_by_borrower_name(original_borrower)
+    if original_user:
+        original_user.return_count += 1
+        api_client._db.save_user(original_user)
     
     # 通知原借用人
     if original_borrower:
@@ -2912,11 +2806,7 @@ def api_edit_remark():
         return jsonify({'success': False, 'message': '请输入备注内容'})
     
     # 查找备注
-    remark = None
-    for r in api_client._remarks:
-        if r.id == remark_id:
-            remark = r
-            break
+    remark = api_client.get_remark_by_id(remark_id)
     
     if not remark:
         return jsonify({'success': False, 'message': '备注不存在'})
@@ -2941,11 +2831,7 @@ def api_delete_remark():
     remark_id = data.get('remark_id')
     
     # 查找备注
-    remark = None
-    for r in api_client._remarks:
-        if r.id == remark_id:
-            remark = r
-            break
+    remark = api_client.get_remark_by_id(remark_id)
     
     if not remark:
         return jsonify({'success': False, 'message': '备注不存在'})
@@ -2966,37 +2852,10 @@ def api_search():
     keyword = request.args.get('keyword', '').strip()
     
     results = []
-    all_devices = api_client.get_all_devices()
+    # 有搜索关键词时由数据库过滤（大小写不敏感）；否则返回所有设备
+    devices = api_client.search_devices(keyword) if keyword else get_request_devices()
     
-    for device in all_devices:
-        # 如果有搜索关键词，进行过滤；否则返回所有设备
-        if keyword:
-            keyword_lower = keyword.lower()
-            name_match = keyword_lower in (device.name or '').lower()
-            model_match = keyword_lower in (device.model or '').lower()
-            borrower_match = keyword_lower in (device.borrower or '').lower()
-            # 车机和仪表字段搜索
-            jira_match = keyword_lower in (device.jira_address or '').lower()
-            project_match = keyword_lower in (device.project_attribute or '').lower()
-            connection_match = keyword_lower in (device.connection_method or '').lower()
-            os_version_match = keyword_lower in (device.os_version or '').lower()
-            os_platform_match = keyword_lower in (device.os_platform or '').lower()
-            product_match = keyword_lower in (device.product_name or '').lower()
-            orientation_match = keyword_lower in (device.screen_orientation or '').lower()
-            resolution_match = keyword_lower in (device.screen_resolution or '').lower()
-            # 手机字段搜索
-            system_version_match = keyword_lower in (device.system_version or '').lower()
-            imei_match = keyword_lower in (device.imei or '').lower()
-            sn_match = keyword_lower in (device.sn or '').lower()
-            carrier_match = keyword_lower in (device.carrier or '').lower()
-            
-            if not (name_match or model_match or borrower_match or 
-                    jira_match or project_match or connection_match or 
-                    os_version_match or os_platform_match or product_match or 
-                    orientation_match or resolution_match or 
-                    system_version_match or imei_match or sn_match or carrier_match):
-                continue
-        
+    for device in devices:
         # 判断是否为使用保管人的设备类型（手机、手机卡、其它设备）
         is_custodian_type = device.device_type in [DeviceType.PHONE, DeviceType.SIM_CARD, DeviceType.OTHER_DEVICE]
 
@@ -3014,7 +2873,7 @@ def api_search():
         results.append({
             'id': device.id,
             'name': device.name,
-            'device_type': get_device_type_str(device),
+            'device_type': device.device_type_label,
             'model': device.model,
             'status': device.status.value,
             'borrower': device.borrower,
@@ -3069,21 +2928,13 @@ def api_add_search_points():
 @app.route('/api/users')
 @login_required
 def api_users():
-    """获取用户列表API"""
-    users = api_client.get_all_users()
-    result = []
-    for user in users:
-        if user.borrower_name and not user.is_frozen:
-            result.append({
-                'id': user.id,
-                'name': user.borrower_name,
-                'email': user.email
-            })
-    return jsonify({'success': True, 'users': result})
+    """获取用户列表API（已设置借用人名称且未冻结的用户）"""
+    return app.response_class(api_client.get_active_users_payload(), mimetype='application/json')
 
 
 @app.route('/api/report-lost', methods=['POST'])
 @login_required
+@device_locked
 def api_report_lost():
     """报备丢失API"""
     user = get_current_user()
@@ -3110,39 +2961,20 @@ def api_report_lost():
         return jsonify({'success': False, 'message': '设备状态异常'})
     
     # 更新设备状态为丢失
-    device.previous_status = device.status.value  # 保存原始状态
-    device.status = DeviceStatus.LOST
-    device.lost_time = datetime.now()
-    device.previous_borrower = device.borrower
-    
-    api_client.update_device(device, source="user")
+    with api_client.device_txn(device, source="user"):
+        device.previous_status = device.status.value  # 保存原始状态
+        device.status = DeviceStatus.LOST
+        device.lost_time = g.now
+        device.previous_borrower = device.borrower
     
     # 添加记录
-    record = Record(
-        id=str(uuid.uuid4()),
-        device_id=device.id,
-        device_name=device.name,
-        device_type=get_device_type_str(device),
-        operation_type=OperationType.REPORT_LOST,
-        operator=user['borrower_name'],
-        operation_time=datetime.now(),
-        borrower=user['borrower_name'],
-        phone=device.phone,
-        reason='用户报备丢失',
-        entry_source=EntrySource.USER.value
-    )
-    api_client._db.save_record(record)
-    
-    api_client.add_operation_log(f"报备丢失: {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
+    save_user_record(device, user, OperationType.REPORT_LOST, user['borrower_name'], '用户报备丢失',
+                     f"报备丢失: {user['borrower_name']}", phone=device.phone)
     
     
     # 通知保管人（如果存在且不是报备人自己）
     if device.cabinet_number and device.cabinet_number != user['borrower_name']:
-        custodian_user = None
-        for u in api_client._users:
-            if u.borrower_name == device.cabinet_number:
-                custodian_user = u
-                break
+        custodian_user = api_client.get_user_by_borrower_name(device.cabinet_number)
         if custodian_user:
             api_client.add_notification(
                 user_id=custodian_user.id,
@@ -3173,45 +3005,147 @@ def api_report_lost():
     })
 
 
+def device_mutation(roles=None, role_message='您不是该设备的当前借用人或保管人',
+                    statuses=None, status_message='设备状态异常', serialize=True, validate=None):
+    """设备状态变更接口装饰器
+
+    统一完成请求解析、设备查找以及身份/状态校验，被装饰的函数以
+    (device, user, data) 调用，只需描述设备状态的变化。
+
+    Args:
+        roles: 允许操作的身份，'borrower'-当前借用人，'custodian'-保管人，None表示不校验
+        role_message: 身份校验失败时的提示
+        statuses: 允许操作的设备状态，None表示不校验
+        status_message: 状态校验失败时的提示
+        serialize: 是否持有该设备的锁（api_client.device_lock）执行，串行化同一设备的读取-修改-保存
+        validate: 只依赖请求数据的校验函数 validate(user, data)，返回错误提示或None；
+            在查找设备之前执行，无效请求不再访问数据库
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function():
+            user = get_current_user()
+            data = request.get_json(cache=True, silent=True) or {}
+
+            device_id = data.get('device_id')
+            if not device_id:
+                return jsonify({'success': False, 'message': '设备不存在'})
+
+            if validate:
+                message = validate(user, data)
+                if message:
+                    return jsonify({'success': False, 'message': message})
+
+            with (api_client.device_lock(device_id) if serialize else nullcontext()):
+                device = api_client.get_device_by_id(device_id)
+                if not device:
+                    return jsonify({'success': False, 'message': '设备不存在'})
+
+                if roles:
+                    me = user['borrower_name']
+                    is_borrower = 'borrower' in roles and device.borrower == me
+                    is_custodian = 'custodian' in roles and device.cabinet_number == me
+                    if not is_borrower and not is_custodian:
+                        return jsonify({'success': False, 'message': role_message})
+
+                if statuses and device.status not in statuses:
+                    return jsonify({'success': False, 'message': status_message})
+
+                return f(device, user, data)
+        return decorated_function
+    return decorator
+
+
+def save_user_record(device, user, operation_type, borrower, reason, log_content=None, phone='', remark='',
+                     operation_time=None):
+    """保存用户端操作的借还记录，传入 log_content 时同时添加操作日志"""
+    me = user['borrower_name']
+    record = Record(
+        id=api_client.new_id(),
+        device_id=device.id,
+        device_name=device.name,
+        device_type=device.device_type_label,
+        operation_type=operation_type,
+        operator=me,
+        operation_time=operation_time or g.now,
+        borrower=borrower,
+        phone=phone,
+        reason=reason,
+        remark=remark,
+        entry_source=EntrySource.USER.value
+    )
+    api_client._db.save_record(record)
+    if log_content:
+        api_client.add_operation_log(log_content, device.name, operator=me, source="user")
+    return record
+
+
+def notify_device_custodian(device, user, title, content, notification_type):
+    """通知设备保管人（保管人存在且不是当前用户时）"""
+    if not device.cabinet_number or device.cabinet_number == user['borrower_name']:
+        return
+    custodian_user = api_client.get_user_by_borrower_name(device.cabinet_number)
+    if custodian_user:
+        api_client.add_notification(
+            user_id=custodian_user.id,
+            user_name=custodian_user.borrower_name,
+            title=title,
+            content=content,
+            device_name=device.name,
+            device_id=device.id,
+            notification_type=notification_type
+        )
+
+
+def points_reward_response(user, points_result, message):
+    """根据积分发放结果构造接口返回"""
+    points_message = ''
+    points_change = 0
+    if points_result['success']:
+        points_message = f'，{points_result["message"]}'
+        points_change = points_result.get('points_change', 0)
+
+    # 获取用户当前总积分
+    total_points = get_user_total_points(user['user_id'])
+
+    return jsonify({
+        'success': True,
+        'message': message + points_message,
+        'points_added': points_change,
+        'total_points': total_points
+    })
+
+
+def _validate_report_damage(user, data):
+    """报备损坏的输入校验"""
+    if not data.get('damage_reason', '').strip():
+        return '请输入损坏情况'
+    return None
+
+
 @app.route('/api/report-damage', methods=['POST'])
 @login_required
-def api_report_damage():
+@device_mutation(roles=('borrower', 'custodian'), validate=_validate_report_damage)
+def api_report_damage(device, user, data):
     """报备损坏API"""
-    user = get_current_user()
-    data = request.json
-    
-    device_id = data.get('device_id')
+    me = user['borrower_name']
     damage_reason = data.get('damage_reason', '').strip()
     action = data.get('action', 'repair')  # repair 或 return
-    
-    if not damage_reason:
-        return jsonify({'success': False, 'message': '请输入损坏情况'})
-    
-    device = api_client.get_device_by_id(device_id)
-    if not device:
-        return jsonify({'success': False, 'message': '设备不存在'})
-    
-    # 检查是否是当前借用人或保管人
-    is_borrower = device.borrower == user['borrower_name']
-    is_custodian = device.cabinet_number == user['borrower_name']
-    
-    if not is_borrower and not is_custodian:
-        return jsonify({'success': False, 'message': '您不是该设备的当前借用人或保管人'})
-    
-    # 借用人只能在借出状态转借
-    if is_borrower and device.status != DeviceStatus.BORROWED:
+
+    # 借用人只能在借出状态报备
+    if device.borrower == me and device.status != DeviceStatus.BORROWED:
         return jsonify({'success': False, 'message': '设备状态异常'})
-    
+
     original_borrower = device.borrower
-    
+
     # 更新设备状态
     device.previous_status = device.status.value  # 保存原始状态
     device.status = DeviceStatus.DAMAGED
     device.damage_reason = damage_reason
-    device.damage_time = datetime.now()
-    
-    api_client.update_device(device, source="user")
-    
+    device.damage_time = g.now
+
+    api_client.update_device_fields(device, ('previous_status', 'status', 'damage_reason', 'damage_time'), source="user")
+
     # 添加记录
     if action == 'return':
         # 归还并报备损坏
@@ -3222,164 +3156,80 @@ def api_report_damage():
         device.reason = ''
         device.entry_source = ''
         device.expected_return_date = None
-        
-        record = Record(
-            id=str(uuid.uuid4()),
-            device_id=device.id,
-            device_name=device.name,
-            device_type=get_device_type_str(device),
-            operation_type=OperationType.REPORT_DAMAGE,
-            operator=user['borrower_name'],
-            operation_time=datetime.now(),
-            borrower=f"损坏归还：{original_borrower}",
-            phone=device.phone,
-            reason=damage_reason,
-            entry_source=EntrySource.USER.value
-        )
-        api_client.add_operation_log(f"损坏归还: {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
+        record_borrower = f"损坏归还：{original_borrower}"
+        log_action = "损坏归还"
     else:
         # 仅报备损坏，继续借用
-        record = Record(
-            id=str(uuid.uuid4()),
-            device_id=device.id,
-            device_name=device.name,
-            device_type=get_device_type_str(device),
-            operation_type=OperationType.REPORT_DAMAGE,
-            operator=user['borrower_name'],
-            operation_time=datetime.now(),
-            borrower=user['borrower_name'],
-            phone=device.phone,
-            reason=damage_reason,
-            entry_source=EntrySource.USER.value
-        )
-        api_client.add_operation_log(f"报备损坏: {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
-    
-    api_client._db.save_record(record)
-    
+        record_borrower = me
+        log_action = "报备损坏"
+
+    save_user_record(device, user, OperationType.REPORT_DAMAGE, record_borrower, damage_reason,
+                     f"{log_action}: {me}", phone=device.phone)
 
     # 通知保管人（如果存在且不是报备人自己）
-    if device.cabinet_number and device.cabinet_number != user['borrower_name']:
-        custodian_user = None
-        for u in api_client._users:
-            if u.borrower_name == device.cabinet_number:
-                custodian_user = u
-                break
-        if custodian_user:
-            api_client.add_notification(
-                user_id=custodian_user.id,
-                user_name=custodian_user.borrower_name,
-                title="设备损坏报备通知",
-                content=f"您保管的设备「{device.name}」已被借用人 {user['borrower_name']} 报备损坏",
-                device_name=device.name,
-                device_id=device.id,
-                notification_type="warning"
-            )
+    notify_device_custodian(device, user, "设备损坏报备通知",
+                            f"您保管的设备「{device.name}」已被借用人 {me} 报备损坏", "warning")
 
     # 损坏报备成功，发放积分奖励
     points_result = points_service.report_reward(user['user_id'], 'damaged', device.name)
-    points_message = ''
-    points_change = 0
-    if points_result['success']:
-        points_message = f'，{points_result["message"]}'
-        points_change = points_result.get('points_change', 0)
-
-    # 获取用户当前总积分
-    total_points = get_user_total_points(user['user_id'])
-
-    return jsonify({
-        'success': True,
-        'message': '损坏报备成功' + points_message,
-        'points_added': points_change,
-        'total_points': total_points
-    })
+    return points_reward_response(user, points_result, '损坏报备成功')
 
 
 @app.route('/api/ship-device', methods=['POST'])
 @login_required
-def api_ship_device():
+@device_mutation(roles=('borrower', 'custodian'), role_message='您不是该设备的借用人或保管人')
+def api_ship_device(device, user, data):
     """设备寄出API"""
-    user = get_current_user()
-    data = request.json
-
-    device_id = data.get('device_id')
+    me = user['borrower_name']
     ship_time_str = data.get('ship_time', '').strip()
     remark = data.get('remark', '').strip()
 
-    device = api_client.get_device_by_id(device_id)
-    if not device:
-        return jsonify({'success': False, 'message': '设备不存在'})
-
-    # 检查是否是借用人或保管人
-    is_borrower = device.borrower == user['borrower_name']
-    is_custodian = device.cabinet_number == user['borrower_name']
-
-    if not is_borrower and not is_custodian:
-        return jsonify({'success': False, 'message': '您不是该设备的借用人或保管人'})
-
     # 只有车机和仪表可以寄出
     if device.device_type not in (DeviceType.CAR_MACHINE, DeviceType.INSTRUMENT):
         return jsonify({'success': False, 'message': '只有车机和仪表可以寄出'})
 
     # 解析寄出时间
-    ship_time = datetime.now()
+    ship_time = g.now
     if ship_time_str:
+        # 去掉末尾的 Z 或时区偏移，按本地时间解析
+        if ship_time_str.endswith('Z'):
+            ship_time_str = ship_time_str[:-1]
+        if '+' in ship_time_str[10:]:
+            ship_time_str = ship_time_str[:ship_time_str.rindex('+')]
         try:
-            ship_time = datetime.fromisoformat(ship_time_str.replace('Z', '+00:00').replace('+00:00', ''))
-        except:
+            ship_time = datetime.fromisoformat(ship_time_str)
+        except ValueError:
             pass
 
     # 保存当前借用信息以便还原（如果在库则记录当前操作用户）
-    device.pre_ship_borrower = device.borrower or user['borrower_name']
-    device.pre_ship_borrow_time = device.borrow_time or datetime.now()
+    device.pre_ship_borrower = device.borrower or me
+    device.pre_ship_borrow_time = device.borrow_time or g.now
     device.pre_ship_expected_return_date = device.expected_return_date
 
     # 更新设备状态
     device.status = DeviceStatus.SHIPPED
     device.ship_time = ship_time
     device.ship_remark = remark
-    device.ship_by = user['borrower_name']
+    device.ship_by = me
 
-    api_client.update_device(device, source="user")
+    api_client.update_device_fields(device, (
+        'status', 'ship_time', 'ship_remark', 'ship_by',
+        'pre_ship_borrower', 'pre_ship_borrow_time', 'pre_ship_expected_return_date'
+    ), source="user")
 
     # 添加记录
-    record = Record(
-        id=str(uuid.uuid4()),
-        device_id=device.id,
-        device_name=device.name,
-        device_type=get_device_type_str(device),
-        operation_type=OperationType.SHIP,
-        operator=user['borrower_name'],
-        operation_time=datetime.now(),
-        borrower=device.pre_ship_borrower or user['borrower_name'],
-        phone=device.phone,
-        reason='已寄出',
-        remark=remark,
-        entry_source=EntrySource.USER.value
-    )
-    api_client._db.save_record(record)
-
-    api_client.add_operation_log(f"寄出设备: {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
-    
+    save_user_record(device, user, OperationType.SHIP, device.pre_ship_borrower or me, '已寄出',
+                     f"寄出设备: {me}", phone=device.phone, remark=remark)
 
     return jsonify({'success': True, 'message': '寄出登记成功'})
 
 
 @app.route('/api/unship-device', methods=['POST'])
 @login_required
-def api_unship_device():
+@device_mutation(statuses=(DeviceStatus.SHIPPED,), status_message='设备不是寄出状态')
+def api_unship_device(device, user, data):
     """设备未寄出（还原）API"""
-    user = get_current_user()
-    data = request.json
-
-    device_id = data.get('device_id')
-
-    device = api_client.get_device_by_id(device_id)
-    if not device:
-        return jsonify({'success': False, 'message': '设备不存在'})
-
-    if device.status != DeviceStatus.SHIPPED:
-        return jsonify({'success': False, 'message': '设备不是寄出状态'})
-
+    me = user['borrower_name']
     # 还原借用信息
     if device.pre_ship_borrower:
         device.status = DeviceStatus.BORROWED
@@ -3398,127 +3248,73 @@ def api_unship_device():
     device.pre_ship_borrow_time = None
     device.pre_ship_expected_return_date = None
 
-    api_client.update_device(device, source="user")
+    api_client.update_device_fields(device, (
+        'status', 'borrower', 'borrow_time', 'expected_return_date',
+        'ship_time', 'ship_remark', 'ship_by',
+        'pre_ship_borrower', 'pre_ship_borrow_time', 'pre_ship_expected_return_date'
+    ), source="user")
 
     # 添加记录
-    record = Record(
-        id=str(uuid.uuid4()),
-        device_id=device.id,
-        device_name=device.name,
-        device_type=get_device_type_str(device),
-        operation_type=OperationType.SHIP,
-        operator=user['borrower_name'],
-        operation_time=datetime.now(),
-        borrower=device.borrower,
-        phone=device.phone,
-        reason='未寄出（还原）',
-        entry_source=EntrySource.USER.value
-    )
-    api_client._db.save_record(record)
-
-    api_client.add_operation_log(f"未寄出还原 {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
-    
+    save_user_record(device, user, OperationType.SHIP, device.borrower, '未寄出（还原）',
+                     f"未寄出还原 {me}", phone=device.phone)
 
     return jsonify({'success': True, 'message': '已还原为借用状态'})
 
 
 @app.route('/api/found-device', methods=['POST'])
 @login_required
-def api_found_device():
+@device_mutation(statuses=(DeviceStatus.LOST,), status_message='设备未处于丢失状态')
+def api_found_device(device, user, data):
     """设备找回API"""
-    user = get_current_user()
-    data = request.json
-    
-    device_id = data.get('device_id')
+    me = user['borrower_name']
     action = data.get('action', 'return')  # return:保管人自用 transfer:转借他人
     transfer_to = data.get('transfer_to', '').strip()
-    
-    device = api_client.get_device_by_id(device_id)
-    
-    if not device:
-        return jsonify({'success': False, 'message': '设备不存在'})
-    
-    # 检查设备是否处于丢失状态
-    if device.status != DeviceStatus.LOST:
-        return jsonify({'success': False, 'message': '设备未处于丢失状态'})
-    
+
     original_borrower = device.borrower
-    
+
     if action == 'transfer':
         # 转借他人
         if not transfer_to:
             return jsonify({'success': False, 'message': '请选择转借人'})
-        
+
         # 检查不能转借给自己
-        if transfer_to == user['borrower_name']:
+        if transfer_to == me:
             return jsonify({'success': False, 'message': '不能转借给自己'})
-        
+
         # 检查不能转借给当前借用人（已经在借用设备的人）
         if transfer_to == device.borrower:
             return jsonify({'success': False, 'message': '该用户已经在借用此设备'})
-        
+
         # 检查转借对象是否存在
-        target_user = None
-        for u in api_client._users:
-            if u.borrower_name == transfer_to:
-                target_user = u
-                break
-        
+        target_user = api_client.get_user_by_borrower_name(transfer_to)
+
         if not target_user:
             return jsonify({'success': False, 'message': '转借对象不存在'})
-        
+
         if target_user.is_frozen:
             return jsonify({'success': False, 'message': '转借对象账号已被冻结'})
-        
+
         # 更新设备状态
         device.status = DeviceStatus.BORROWED
         device.borrower = transfer_to
         device.lost_time = None
         device.previous_status = ''  # 清空原始状态记录
-        
-        api_client.update_device(device, source="user")
-        
-        # 添加记录
-        record = Record(
-            id=str(uuid.uuid4()),
-            device_id=device.id,
-            device_name=device.name,
-            device_type=get_device_type_str(device),
-            operation_type=OperationType.FOUND,
-            operator=user['borrower_name'],
-            operation_time=datetime.now(),
-            borrower=f"找回转借：{original_borrower or '丢失'}——>{transfer_to}",
-            reason='设备找回后转借',
-            entry_source=EntrySource.USER.value
-        )
-        api_client._db.save_record(record)
-        api_client.add_operation_log(f"设备找回转借 {transfer_to}", device.name, operator=user['borrower_name'], source="user")
+
+        record_borrower = f"找回转借：{original_borrower or '丢失'}——>{transfer_to}"
+        record_reason = '设备找回后转借'
+        log_content = f"设备找回转借 {transfer_to}"
     elif action == 'keep':
         # 转给自己 - 设备变为借出状态
         device.status = DeviceStatus.BORROWED
-        device.borrower = user['borrower_name']
-        device.borrow_time = datetime.now()
+        device.borrower = me
+        device.borrow_time = g.now
         device.lost_time = None
         device.previous_status = ''  # 清空原始状态记录
-        
-        api_client.update_device(device, source="user")
-        
-        # 添加记录
+
         from_desc = original_borrower or '丢失状态'
-        record = Record(
-            id=str(uuid.uuid4()),
-            device_id=device.id,
-            device_name=device.name,
-            device_type=get_device_type_str(device),
-            operation_type=OperationType.FOUND,
-            operator=user['borrower_name'],
-            operation_time=datetime.now(),
-            borrower=f"找回：{from_desc}——>{user['borrower_name']}",
-            reason='设备已找回，转给自己',
-            entry_source=EntrySource.USER.value
-        )
-        api_client._db.save_record(record)
-        api_client.add_operation_log(f"设备找回转给自己: {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
+        record_borrower = f"找回：{from_desc}——>{me}"
+        record_reason = '设备已找回，转给自己'
+        log_content = f"设备找回转给自己: {me}"
     else:
         # 归还入库 - 恢复设备原始状态（流通、无柜号、封存等）
         previous_status = device.previous_status
@@ -3537,112 +3333,56 @@ def api_found_device():
         device.lost_time = None
         device.previous_status = ''  # 清空原始状态记录
 
-        api_client.update_device(device, source="user")
-
-        # 添加记录
         from_desc = original_borrower or '丢失状态'
         to_status = device.status.value
-        record = Record(
-            id=str(uuid.uuid4()),
-            device_id=device.id,
-            device_name=device.name,
-            device_type=get_device_type_str(device),
-            operation_type=OperationType.FOUND,
-            operator=user['borrower_name'],
-            operation_time=datetime.now(),
-            borrower=f"找回：{from_desc}——>{to_status}",
-            reason=f'设备已找回，恢复为{to_status}状态',
-            entry_source=EntrySource.USER.value
-        )
-        api_client._db.save_record(record)
-        api_client.add_operation_log(f"设备找回归还: {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
-    
-    
-    
+        record_borrower = f"找回：{from_desc}——>{to_status}"
+        record_reason = f'设备已找回，恢复为{to_status}状态'
+        log_content = f"设备找回归还: {me}"
+
+    api_client.update_device_fields(device, ('status', 'borrower', 'borrow_time', 'expected_return_date', 'lost_time', 'previous_status'), source="user")
+
+    # 添加记录
+    save_user_record(device, user, OperationType.FOUND, record_borrower, record_reason, log_content)
+
     # 通知保管人（如果存在且不是当前用户）
-    if device.cabinet_number and device.cabinet_number != user['borrower_name']:
-        custodian_user = None
-        for u in api_client._users:
-            if u.borrower_name == device.cabinet_number:
-                custodian_user = u
-                break
-        if custodian_user:
-            if action == 'transfer':
-                action_desc = f'被找回并转借给 {transfer_to}'
-            else:
-                action_desc = '被找回并归还'
-            api_client.add_notification(
-                user_id=custodian_user.id,
-                user_name=custodian_user.borrower_name,
-                title="设备找回通知",
-                content=f"您保管的设备「{device.name}」{action_desc}",
-                device_name=device.name,
-                device_id=device.id,
-                notification_type="success"
-            )
-    
+    action_desc = f'被找回并转借给 {transfer_to}' if action == 'transfer' else '被找回并归还'
+    notify_device_custodian(device, user, "设备找回通知",
+                            f"您保管的设备「{device.name}」{action_desc}", "success")
+
     # 设备找回成功，发放积分奖励
     points_result = points_service.report_reward(user['user_id'], 'found', device.name)
-    points_message = ''
-    points_change = 0
-    if points_result['success']:
-        points_message = f'，{points_result["message"]}'
-        points_change = points_result.get('points_change', 0)
-
-    # 获取用户当前总积分
-    total_points = get_user_total_points(user['user_id'])
-
-    return jsonify({
-        'success': True,
-        'message': '设备找回成功' + points_message,
-        'points_added': points_change,
-        'total_points': total_points
-    })
+    return points_reward_response(user, points_result, '设备找回成功')
 
 
 @app.route('/api/repair-device', methods=['POST'])
 @login_required
-def api_repair_device():
+@device_mutation(statuses=(DeviceStatus.DAMAGED,), status_message='设备未处于损坏状态')
+def api_repair_device(device, user, data):
     """设备修复API"""
-    user = get_current_user()
-    data = request.json
-    
-    device_id = data.get('device_id')
+    me = user['borrower_name']
     action = data.get('action', 'return')  # return:保管人自用 transfer:转借他人
     transfer_to = data.get('transfer_to', '').strip()
-    
-    device = api_client.get_device_by_id(device_id)
-    if not device:
-        return jsonify({'success': False, 'message': '设备不存在'})
-    
-    # 检查设备是否处于损坏状态
-    if device.status != DeviceStatus.DAMAGED:
-        return jsonify({'success': False, 'message': '设备未处于损坏状态'})
-    
+
     original_borrower = device.borrower
-    
+
     if action == 'transfer':
         # 转借他人
         if not transfer_to:
             return jsonify({'success': False, 'message': '请选择转借人'})
-        
+
         # 检查不能转借给自己
-        if transfer_to == user['borrower_name']:
+        if transfer_to == me:
             return jsonify({'success': False, 'message': '不能转借给自己'})
-        
+
         # 检查转借对象是否存在
-        target_user = None
-        for u in api_client._users:
-            if u.borrower_name == transfer_to:
-                target_user = u
-                break
-        
+        target_user = api_client.get_user_by_borrower_name(transfer_to)
+
         if not target_user:
             return jsonify({'success': False, 'message': '转借对象不存在'})
-        
+
         if target_user.is_frozen:
             return jsonify({'success': False, 'message': '转借对象账号已被冻结'})
-        
+
         # 修复并转借
         device.status = DeviceStatus.BORROWED
         device.borrower = transfer_to
@@ -3650,45 +3390,21 @@ def api_repair_device():
         device.damage_time = None
         device.previous_status = ''  # 清空原始状态记录
 
-        api_client.update_device(device, source="user")
-
-        record = Record(
-            id=str(uuid.uuid4()),
-            device_id=device.id,
-            device_name=device.name,
-            device_type=get_device_type_str(device),
-            operation_type=OperationType.REPAIRED,
-            operator=user['borrower_name'],
-            operation_time=datetime.now(),
-            borrower=f"修复转借：{original_borrower or '损坏'}——>{transfer_to}",
-            reason='设备已修复并转借',
-            entry_source=EntrySource.USER.value
-        )
-        api_client.add_operation_log(f"修复转借 {transfer_to}", device.name, operator=user['borrower_name'], source="user")
+        record_borrower = f"修复转借：{original_borrower or '损坏'}——>{transfer_to}"
+        record_reason = '设备已修复并转借'
+        log_content = f"修复转借 {transfer_to}"
     elif action == 'keep':
         # 转给自己 - 设备变为借出状态
         device.status = DeviceStatus.BORROWED
-        device.borrower = user['borrower_name']
-        device.borrow_time = datetime.now()
+        device.borrower = me
+        device.borrow_time = g.now
         device.damage_reason = ''
         device.damage_time = None
         device.previous_status = ''  # 清空原始状态记录
 
-        api_client.update_device(device, source="user")
-        
-        record = Record(
-            id=str(uuid.uuid4()),
-            device_id=device.id,
-            device_name=device.name,
-            device_type=get_device_type_str(device),
-            operation_type=OperationType.REPAIRED,
-            operator=user['borrower_name'],
-            operation_time=datetime.now(),
-            borrower=f"修复：{original_borrower or '损坏'}——>{user['borrower_name']}",
-            reason='设备已修复，转给自己',
-            entry_source=EntrySource.USER.value
-        )
-        api_client.add_operation_log(f"修复转给自己: {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
+        record_borrower = f"修复：{original_borrower or '损坏'}——>{me}"
+        record_reason = '设备已修复，转给自己'
+        log_content = f"修复转给自己: {me}"
     else:
         # 归还入库 - 恢复设备原始状态（流通、无柜号、封存等）
         previous_status = device.previous_status
@@ -3708,223 +3424,109 @@ def api_repair_device():
         device.damage_time = None
         device.previous_status = ''  # 清空原始状态记录
 
-        api_client.update_device(device, source="user")
-        
         to_status = device.status.value
-        record = Record(
-            id=str(uuid.uuid4()),
-            device_id=device.id,
-            device_name=device.name,
-            device_type=get_device_type_str(device),
-            operation_type=OperationType.REPAIRED,
-            operator=user['borrower_name'],
-            operation_time=datetime.now(),
-            borrower=f"修复：{original_borrower or '损坏'}——>{to_status}",
-            reason=f'设备已修复，恢复为{to_status}状态',
-            entry_source=EntrySource.USER.value
-        )
-        api_client.add_operation_log(f"修复归还: {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
-    
-    api_client._db.save_record(record)
-    
-    
+        record_borrower = f"修复：{original_borrower or '损坏'}——>{to_status}"
+        record_reason = f'设备已修复，恢复为{to_status}状态'
+        log_content = f"修复归还: {me}"
+
+    api_client.update_device_fields(device, (
+        'status', 'borrower', 'borrow_time', 'expected_return_date',
+        'damage_reason', 'damage_time', 'previous_status'
+    ), source="user")
+
+    save_user_record(device, user, OperationType.REPAIRED, record_borrower, record_reason, log_content)
+
     # 通知保管人（如果存在且不是当前用户）
-    if device.cabinet_number and device.cabinet_number != user['borrower_name']:
-        custodian_user = None
-        for u in api_client._users:
-            if u.borrower_name == device.cabinet_number:
-                custodian_user = u
-                break
-        if custodian_user:
-            if action == 'transfer':
-                action_desc = f'被修复并转借给 {transfer_to}'
-            else:
-                action_desc = '被修复并归还'
-            api_client.add_notification(
-                user_id=custodian_user.id,
-                user_name=custodian_user.borrower_name,
-                title="设备修复通知",
-                content=f"您保管的设备「{device.name}」{action_desc}",
-                device_name=device.name,
-                device_id=device.id,
-                notification_type="success"
-            )
-    
+    action_desc = f'被修复并转借给 {transfer_to}' if action == 'transfer' else '被修复并归还'
+    notify_device_custodian(device, user, "设备修复通知",
+                            f"您保管的设备「{device.name}」{action_desc}", "success")
+
     # 设备修复成功，发放积分奖励
     points_result = points_service.report_reward(user['user_id'], 'fixed', device.name)
-    points_message = ''
-    points_change = 0
-    if points_result['success']:
-        points_message = f'，{points_result["message"]}'
-        points_change = points_result.get('points_change', 0)
-
-    # 获取用户当前总积分
-    total_points = get_user_total_points(user['user_id'])
-
-    return jsonify({
-        'success': True,
-        'message': '操作成功' + points_message,
-        'points_added': points_change,
-        'total_points': total_points
-    })
+    return points_reward_response(user, points_result, '操作成功')
 
 
 @app.route('/api/not-found', methods=['POST'])
 @login_required
-def api_not_found():
+@device_mutation(roles=('borrower',), role_message='只有当前借用人可以操作', statuses=(DeviceStatus.BORROWED,))
+def api_not_found(device, user, data):
     """未找到（转给自己后的退回）API"""
-    user = get_current_user()
-    data = request.json
-    
-    device_id = data.get('device_id')
-    device = api_client.get_device_by_id(device_id)
-    
-    if not device:
-        return jsonify({'success': False, 'message': '设备不存在'})
-    
-    if device.status != DeviceStatus.BORROWED:
-        return jsonify({'success': False, 'message': '设备状态异常'})
-    
-    if device.borrower != user['borrower_name']:
-        return jsonify({'success': False, 'message': '只有当前借用人可以操作'})
-    
+    me = user['borrower_name']
     previous_borrower = device.previous_borrower
-    
+
     if previous_borrower:
         # 有上一个借用人，转回给他
         device.borrower = previous_borrower
         device.phone = ''  # 清空手机号
         device.previous_borrower = ''  # 清空上一个借用人
-        
-        api_client.update_device(device, source="user")
-        
+
+        api_client.update_device_fields(device, ('borrower', 'phone', 'previous_borrower'), source="user")
+
         # 添加记录 - 使用 NOT_FOUND 类型
-        record = Record(
-            id=str(uuid.uuid4()),
-            device_id=device.id,
-            device_name=device.name,
-            device_type=get_device_type_str(device),
-            operation_type=OperationType.NOT_FOUND,
-            operator=user['borrower_name'],
-            operation_time=datetime.now(),
-            borrower=f"未找到：{user['borrower_name']}——>{previous_borrower}",
-            phone='',
-            reason='设备未找到，退回给上一个借用人',
-            entry_source=EntrySource.USER.value
-        )
-        api_client._db.save_record(record)
-        api_client.add_operation_log(f"未找到退回 {user['borrower_name']} -> {previous_borrower}", device.name, operator=user['borrower_name'], source="user")
+        save_user_record(device, user, OperationType.NOT_FOUND,
+                         f"未找到：{me}——>{previous_borrower}", '设备未找到，退回给上一个借用人',
+                         f"未找到退回 {me} -> {previous_borrower}")
     else:
         # 没有上一个借用人，转为丢失状态
         device.previous_status = device.status.value  # 保存原始状态
         device.status = DeviceStatus.LOST
         device.previous_borrower = device.borrower
-        device.lost_time = datetime.now()
-        
-        api_client.update_device(device, source="user")
-        
+        device.lost_time = g.now
+
+        api_client.update_device_fields(device, ('previous_status', 'status', 'previous_borrower', 'lost_time'), source="user")
+
         # 添加记录
-        record = Record(
-            id=str(uuid.uuid4()),
-            device_id=device.id,
-            device_name=device.name,
-            device_type=get_device_type_str(device),
-            operation_type=OperationType.REPORT_LOST,
-            operator=user['borrower_name'],
-            operation_time=datetime.now(),
-            borrower=f"未找到转丢失：{user['borrower_name']}",
-            phone=device.phone,
-            reason='设备未找到，转为丢失状态',
-            entry_source=EntrySource.USER.value
-        )
-        api_client._db.save_record(record)
-        api_client.add_operation_log(f"未找到转丢失: {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
-    
-    
+        save_user_record(device, user, OperationType.REPORT_LOST,
+                         f"未找到转丢失：{me}", '设备未找到，转为丢失状态',
+                         f"未找到转丢失: {me}", phone=device.phone)
+
     return jsonify({'success': True, 'message': '操作成功'})
 
 
 @app.route('/api/not-found-direct', methods=['POST'])
 @login_required
-def api_not_found_direct():
+@device_mutation(roles=('borrower',), role_message='您不是该设备的当前借用人', statuses=(DeviceStatus.BORROWED,))
+def api_not_found_direct(device, user, data):
     """直接标记为未找到（丢失）API"""
-    user = get_current_user()
-    data = request.json
-    
-    device_id = data.get('device_id')
-    device = api_client.get_device_by_id(device_id)
-    
-    if not device:
-        return jsonify({'success': False, 'message': '设备不存在'})
-    
-    # 检查是否是当前借用人
-    if device.borrower != user['borrower_name']:
-        return jsonify({'success': False, 'message': '您不是该设备的当前借用人'})
-    
-    if device.status != DeviceStatus.BORROWED:
-        return jsonify({'success': False, 'message': '设备状态异常'})
-    
+    me = user['borrower_name']
     original_borrower = device.borrower
-    
+
     # 转为丢失状态，清空借用人信息
     device.previous_status = device.status.value  # 保存原始状态
     device.status = DeviceStatus.LOST
     device.previous_borrower = original_borrower
-    device.lost_time = datetime.now()
+    device.lost_time = g.now
     device.borrower = ''  # 清空借用人，设备不在任何人名下
     device.phone = ''
-    
-    api_client.update_device(device, source="user")
-    
+
+    api_client.update_device_fields(device, ('previous_status', 'status', 'previous_borrower', 'lost_time', 'borrower', 'phone'), source="user")
+
     # 添加记录
-    record = Record(
-        id=str(uuid.uuid4()),
-        device_id=device.id,
-        device_name=device.name,
-        device_type=get_device_type_str(device),
-        operation_type=OperationType.NOT_FOUND,
-        operator=user['borrower_name'],
-        operation_time=datetime.now(),
-        borrower='未找到：库中未找到',
-        phone='',
-        reason='设备未找到，标记为丢失，不在任何人名下',
-        entry_source=EntrySource.USER.value
-    )
-    api_client._db.save_record(record)
-    api_client.add_operation_log(f"未找到标记丢失 {user['borrower_name']}", device.name, operator=user['borrower_name'], source="user")
-    
-    
+    save_user_record(device, user, OperationType.NOT_FOUND, '未找到：库中未找到', '设备未找到，标记为丢失，不在任何人名下',
+                     f"未找到标记丢失 {me}")
+
     return jsonify({'success': True, 'message': '已标记为丢失'})
 
 
-@app.route('/api/transfer-custodian', methods=['POST'])
-@login_required
-def api_transfer_custodian():
-    """转让保管人API"""
-    user = get_current_user()
-    data = request.json
-    
-    # 重新加载数据以获取最新状态
-    api_client.reload_data()
-    
-    device_id = data.get('device_id')
+def _validate_transfer_custodian(user, data):
+    """转让保管人的输入校验"""
     new_custodian = data.get('new_custodian', '').strip()
-    device = api_client.get_device_by_id(device_id)
-    
-    if not device:
-        return jsonify({'success': False, 'message': '设备不存在'})
-    
-    # 检查当前用户是否为该设备的保管人
-    if device.cabinet_number != user['borrower_name']:
-        return jsonify({'success': False, 'message': '您不是该设备的保管人'})
-    
     if not new_custodian:
-        return jsonify({'success': False, 'message': '请选择新保管人'})
-    
+        return '请选择新保管人'
     # 检查不能转让给自己
     if new_custodian == user['borrower_name']:
-        return jsonify({'success': False, 'message': '不能转让给自己'})
-    
+        return '不能转让给自己'
+    return None
+
+
+@app.route('/api/transfer-custodian', methods=['POST'])
+@login_required
+@device_mutation(roles=('custodian',), role_message='您不是该设备的保管人',
+                 validate=_validate_transfer_custodian)
+def api_transfer_custodian(device, user, data):
+    """转让保管人API"""
+    new_custodian = data.get('new_custodian', '').strip()
+
     # 查找新保管人信息
     target_user = None
     if '@' in new_custodian:
@@ -3932,38 +3534,23 @@ def api_transfer_custodian():
         target_user = api_client.get_user_by_email(new_custodian)
     else:
         # 通过姓名查找
-        for u in api_client._users:
-            if u.borrower_name == new_custodian:
-                target_user = u
-                break
-    
+        target_user = api_client.get_user_by_borrower_name(new_custodian)
+
     if not target_user:
         return jsonify({'success': False, 'message': '新保管人不存在'})
-    
+
     original_custodian = device.cabinet_number
-    
+
     # 转让保管人（修改 cabinet_number）
     device.cabinet_number = target_user.borrower_name
-    
-    api_client.update_device(device, source="user")
-    
+
+    api_client.update_device_fields(device, ('cabinet_number',), source="user")
+
     # 添加记录
-    record = Record(
-        id=str(uuid.uuid4()),
-        device_id=device.id,
-        device_name=device.name,
-        device_type=get_device_type_str(device),
-        operation_type=OperationType.CUSTODIAN_CHANGE,
-        operator=user['borrower_name'],
-        operation_time=datetime.now(),
-        borrower=f"转让保管人：{original_custodian}——>{new_custodian}",
-        reason='设备转让保管人',
-        entry_source=EntrySource.USER.value
-    )
-    api_client._db.save_record(record)
-    api_client.add_operation_log(f"转让保管人 {original_custodian} -> {new_custodian}", device.name, operator=user['borrower_name'], source="user")
-    
-    
+    save_user_record(device, user, OperationType.CUSTODIAN_CHANGE,
+                     f"转让保管人：{original_custodian}——>{new_custodian}", '设备转让保管人',
+                     f"转让保管人 {original_custodian} -> {new_custodian}")
+
     # 发送通知给新保管人
     api_client.add_notification(
         user_id=target_user.id,
@@ -3974,67 +3561,80 @@ def api_transfer_custodian():
         device_id=device.id,
         notification_type="info"
     )
-    
+
     return jsonify({'success': True, 'message': '转让保管人成功'})
 
 
+# 按天数续借时单次最多续借的天数
+RENEW_MAX_DAYS = 365
+
+
 @app.route('/api/renew', methods=['POST'])
 @login_required
-def api_renew():
-    """续借设备API"""
-    user = get_current_user()
-    data = request.json
-    
-    # 重新加载数据以获取最新状态
-    api_client.reload_data()
-    
-    device_id = data.get('device_id')
+@device_mutation(roles=('borrower', 'custodian'))
+def api_renew(device, user, data):
+    """续借设备API
+
+    传入 new_return_date 时按指定日期续借（空字符串或null表示续借为长期借用）；
+    未传入时按 days 天数在原预计归还时间基础上顺延，长期借用保持不变
+    """
+    me = user['borrower_name']
+    device_id = device.id
+    now = g.now
     days = data.get('days', 1)
-    new_return_date = data.get('new_return_date', '').strip()
-    
-    device = api_client.get_device_by_id(device_id)
-    if not device:
-        return jsonify({'success': False, 'message': '设备不存在'})
-    
-    # 检查是否是当前借用人或保管人
-    is_borrower = device.borrower == user['borrower_name']
-    is_custodian = device.cabinet_number == user['borrower_name']
-    
-    if not is_borrower and not is_custodian:
-        return jsonify({'success': False, 'message': '您不是该设备的当前借用人或保管人'})
-    
-    # 借用人只能在借出状态转借
-    if is_borrower and device.status != DeviceStatus.BORROWED:
+    new_return_date = (data.get('new_return_date') or '').strip()
+    renew_by_days = 'new_return_date' not in data
+
+    if renew_by_days:
+        try:
+            days = int(days)
+        except (TypeError, ValueError):
+            days = 0
+        if not 1 <= days <= RENEW_MAX_DAYS:
+            return jsonify({'success': False, 'message': '续借天数格式错误'})
+
+    # 借用人只能在借出状态续借
+    if device.borrower == me and device.status != DeviceStatus.BORROWED:
         return jsonify({'success': False, 'message': '设备状态异常'})
-    
+
     # 检查是否逾期超过3天
-    if device.expected_return_date:
-        now = datetime.now()
-        if now > device.expected_return_date:
-            overdue_days = (now.date() - device.expected_return_date.date()).days
-            if overdue_days > 3:
-                return jsonify({'success': False, 'message': '无法续期，设备已逾期超过3天，请先归还后再借用'})
-    
+    if device.expected_return_date and now > device.expected_return_date:
+        overdue_days = (now.date() - device.expected_return_date.date()).days
+        if overdue_days > 3:
+            return jsonify({'success': False, 'message': '无法续期，设备已逾期超过3天，请先归还后再借用'})
+
     # 计算新的预计归还日期
-    if new_return_date:
+    if renew_by_days and device.expected_return_date is None:
+        # 长期借用按天数续借时仍保持长期借用
+        new_expected_return_date = None
+    elif renew_by_days:
+        # 按天数顺延：从原预计归还时间开始计算，已逾期时从当前时间开始
+        base = max(device.expected_return_date, now)
+        new_expected_return_date = base + timedelta(days=days)
+    elif new_return_date:
         # 使用前端传递的完整日期时间
-        from datetime import datetime as dt
         try:
             # 尝试解析完整格式 YYYY-MM-DD HH:MM:SS
-            new_expected_return_date = dt.strptime(new_return_date, '%Y-%m-%d %H:%M:%S')
+            new_expected_return_date = datetime.strptime(new_return_date, '%Y-%m-%d %H:%M:%S')
         except ValueError:
-            # 兼容旧格式 YYYY-MM-DD，时间设为当前时间
-            date_part = dt.strptime(new_return_date, '%Y-%m-%d')
-            now = dt.now()
-            new_expected_return_date = date_part.replace(hour=now.hour, minute=now.minute, second=now.second)
+            # 兼容旧格式 YYYY-MM-DD，时间设为当前时间（固定格式直接切片，避免 strptime 的格式解析开销）
+            digits = new_return_date[0:4] + new_return_date[5:7] + new_return_date[8:10]
+            if not (len(new_return_date) == 10 and new_return_date[4] == new_return_date[7] == '-'
+                    and digits.isascii() and digits.isdigit()):
+                return jsonify({'success': False, 'message': '归还日期格式错误'})
+            try:
+                new_expected_return_date = datetime(int(new_return_date[0:4]), int(new_return_date[5:7]), int(new_return_date[8:10]),
+                                                    now.hour, now.minute, now.second)
+            except ValueError:
+                return jsonify({'success': False, 'message': '归还日期格式错误'})
     else:
         # 长期借用，不设置归还日期（空字符串或None都表示长期借用）
         new_expected_return_date = None
-    
+
     # 检查续期是否与预约冲突
     # 获取设备类型
-    device_type = get_device_type_str(device)
-    
+    device_type = device.device_type_label
+
     # 检查是否有预约与新的归还日期冲突（长期借用不检查冲突）
     if new_expected_return_date is not None:
         reservations = api_client._db.get_reservations_by_device(device_id, device_type)
@@ -4054,67 +3654,26 @@ def api_renew():
                         'success': False,
                         'message': f"无法续期，该设备已被 {reservation.reserver_name} 预约，预约时间 {reservation.start_time.strftime('%Y-%m-%d %H:%M')} 至 {reservation.end_time.strftime('%Y-%m-%d %H:%M')}"
                     })
-    
+
     # 更新设备的预计归还日期
     device.expected_return_date = new_expected_return_date
-    
-    api_client.update_device(device, source="user")
-    
+
+    api_client.update_device_fields(device, ('expected_return_date',), source="user")
+
     # 添加记录
-    record = Record(
-        id=str(uuid.uuid4()),
-        device_id=device.id,
-        device_name=device.name,
-        device_type=get_device_type_str(device),
-        operation_type=OperationType.RENEW,
-        operator=user['borrower_name'],
-        operation_time=datetime.now(),
-        borrower=user['borrower_name'],
-        phone=device.phone,
-        reason=f'续借 {days} 天' if new_expected_return_date else '续借为长期借用',
-        entry_source=EntrySource.USER.value
-    )
-    api_client._db.save_record(record)
-    api_client.add_operation_log(f"续借设备 {user['borrower_name']}, {days if new_expected_return_date else '长期'}天", device.name, operator=user['borrower_name'], source="user")
-    
-    
+    save_user_record(device, user, OperationType.RENEW, me,
+                     f'续借 {days} 天' if new_expected_return_date else '续借为长期借用',
+                     f"续借设备 {me}, {days if new_expected_return_date else '长期'}天",
+                     phone=device.phone)
+
     # 通知保管人（如果存在且不是借用人自己）
-    if device.cabinet_number and device.cabinet_number != user['borrower_name']:
-        custodian_user = None
-        for u in api_client._users:
-            if u.borrower_name == device.cabinet_number:
-                custodian_user = u
-                break
-        if custodian_user:
-            return_date_str = device.expected_return_date.strftime('%Y-%m-%d') if device.expected_return_date else '长期借用'
-            api_client.add_notification(
-                user_id=custodian_user.id,
-                user_name=custodian_user.borrower_name,
-                title="设备借用续期通知",
-                content=f"您保管的设备「{device.name}」已被借用人 {user['borrower_name']} 续期，新的预计归还日期：{return_date_str}",
-                device_name=device.name,
-                device_id=device.id,
-                notification_type="info"
-            )
-    
+    return_date_str = device.expected_return_date.strftime('%Y-%m-%d') if device.expected_return_date else '长期借用'
+    notify_device_custodian(device, user, "设备借用续期通知",
+                            f"您保管的设备「{device.name}」已被借用人 {me} 续期，新的预计归还日期：{return_date_str}", "info")
+
     # 续借成功，发放积分奖励
     points_result = points_service.renew_reward(user['user_id'], device.name)
-    points_message = ''
-    points_change = 0
-    if points_result['success']:
-        points_message = f'，{points_result["message"]}'
-        points_change = points_result.get('points_change', 0)
-
-    # 获取用户当前总积分
-    total_points = get_user_total_points(user['user_id'])
-
-    return_date_msg = device.expected_return_date.strftime('%Y-%m-%d') if device.expected_return_date else '长期借用'
-    return jsonify({
-        'success': True,
-        'message': f'续借成功，新的预计归还日期: {return_date_msg}' + points_message,
-        'points_added': points_change,
-        'total_points': total_points
-    })
+    return points_reward_response(user, points_result, f'续借成功，新的预计归还日期: {return_date_str}')
 
 
 # ==================== 通知API ====================
@@ -4291,7 +3850,6 @@ def api_user_current_cursor():
 @login_required
 def pc_points_shop():
     """PC端积分商城页面"""
-    api_client.reload_data()
     user = get_current_user()
     
     # 获取用户积分详情
@@ -4325,7 +3883,7 @@ def pc_points_shop():
             item.is_equipped = (item.id == current_cursor_id)
     
     # 获取今日积分统计
-    today = datetime.now().strftime('%Y-%m-%d')
+    today = g.now.strftime('%Y-%m-%d')
     today_stats = {
         'daily_login': False,
         'like_count': 0,
@@ -4398,7 +3956,6 @@ def api_use_inventory_item():
             return jsonify({'success': False, 'message': '用户不存在'})
         
         from common.models import ShopItemType
-        from datetime import datetime
         
         # 根据物品类型更新用户装备
         if inventory_item.item_type == ShopItemType.TITLE:
@@ -4422,10 +3979,7 @@ def api_use_inventory_item():
         api_client._db.save_user(full_user)
         
         # 更新物品使用状态
-        api_client._db.update_inventory_item_status(inventory_id, True, datetime.now())
-        
-        # 刷新api_client中的用户数据
-        api_client.reload_data()
+        api_client._db.update_inventory_item_status(inventory_id, True, g.now)
         
         item_type_name = '称号' if inventory_item.item_type == ShopItemType.TITLE else '头像边框'
         return jsonify({
@@ -4486,7 +4040,6 @@ def api_shop_buy():
 
         # 添加物品到背包
         from common.models import UserInventory, ShopItemSource
-        import uuid
         inventory_item = UserInventory(
             id=str(uuid.uuid4()),
             user_id=user_id,
@@ -4578,7 +4131,7 @@ def api_shop_equip():
             for inv_item in inventory_items:
                 if inv_item.item_id == item_id:
                     api_client._db.update_inventory_item_status(
-                        inv_item.id, True, datetime.now()
+                        inv_item.id, True, g.now
                     )
 
             return jsonify({
@@ -4596,7 +4149,7 @@ def api_shop_equip():
             for inv_item in inventory_items:
                 if inv_item.item_id == item_id:
                     api_client._db.update_inventory_item_status(
-                        inv_item.id, True, datetime.now()
+                        inv_item.id, True, g.now
                     )
 
             return jsonify({
@@ -4616,7 +4169,6 @@ def api_shop_equip():
 @login_required
 def pc_bounties():
     """PC端悬赏榜单页面"""
-    api_client.reload_data()
     user = get_current_user()
 
     # 获取所有悬赏
@@ -4676,21 +4228,19 @@ def api_get_bounties():
     else:
         bounties = api_client._db.get_all_bounties(status=status)
 
+    # 用户头像索引（按用户ID），避免每个悬赏都遍历一次用户列表
+    avatars_by_id = {u.id: u.avatar for u in api_client.get_all_users()} if bounties else {}
+
     # 转换为字典列表
     bounty_list = []
     for bounty in bounties:
         bounty_dict = bounty.to_dict()
         # 添加发布人头像
-        for u in api_client._users:
-            if u.id == bounty.publisher_id:
-                bounty_dict['publisher_avatar'] = u.avatar
-                break
+        if bounty.publisher_id in avatars_by_id:
+            bounty_dict['publisher_avatar'] = avatars_by_id[bounty.publisher_id]
         # 添加认领人头像
-        if bounty.claimer_id:
-            for u in api_client._users:
-                if u.id == bounty.claimer_id:
-                    bounty_dict['claimer_avatar'] = u.avatar
-                    break
+        if bounty.claimer_id and bounty.claimer_id in avatars_by_id:
+            bounty_dict['claimer_avatar'] = avatars_by_id[bounty.claimer_id]
         bounty_list.append(bounty_dict)
 
     return jsonify({'success': True, 'bounties': bounty_list})
@@ -4704,29 +4254,18 @@ def api_search_devices():
     if not keyword:
         return jsonify({'success': True, 'devices': []})
 
-    # 搜索设备
-    all_devices = api_client._db.get_all_devices()
-    matched_devices = []
-
-    for device in all_devices:
-        # 匹配设备名称、型号、SN码、IMEI等
-        name_match = device.name and keyword.lower() in device.name.lower()
-        model_match = device.model and keyword.lower() in device.model.lower()
-        sn_match = (hasattr(device, 'sn') and device.sn and keyword.lower() in device.sn.lower())
-        imei_match = (hasattr(device, 'imei') and device.imei and keyword.lower() in device.imei.lower())
-
-        if name_match or model_match or sn_match or imei_match:
-            matched_devices.append({
-                'id': device.id,
-                'name': device.name,
-                'model': device.model,
-                'device_type': device.device_type.value if hasattr(device.device_type, 'value') else str(device.device_type),
-                'status': device.status.value if hasattr(device.status, 'value') else str(device.status),
-                'cabinet_number': device.cabinet_number
-            })
+    # 匹配设备名称、型号、SN码、IMEI，最多返回10条结果
+    devices = api_client.search_devices(keyword, fields=('name', 'model', 'sn', 'imei'), limit=10)
+    matched_devices = [{
+        'id': device.id,
+        'name': device.name,
+        'model': device.model,
+        'device_type': device.device_type.value if hasattr(device.device_type, 'value') else str(device.device_type),
+        'status': device.status.value if hasattr(device.status, 'value') else str(device.status),
+        'cabinet_number': device.cabinet_number
+    } for device in devices]
 
-    # 最多返回10条结果
-    return jsonify({'success': True, 'devices': matched_devices[:10]})
+    return jsonify({'success': True, 'devices': matched_devices})
 
 
 @app.route('/api/bounties', methods=['POST'])
@@ -4783,8 +4322,6 @@ def api_create_bounty():
 
     # 创建悬赏
     from common.models import Bounty, BountyStatus
-    import uuid
-    from datetime import datetime
 
     # 保存设备之前的状态
     device_previous_status = ""
@@ -4808,20 +4345,7 @@ def api_create_bounty():
 
     # 添加设备借用记录
     if device:
-        from common.models import Record, OperationType
-        record = Record(
-            id=str(uuid.uuid4()),
-            device_id=device.id,
-            device_name=device.name,
-            device_type=get_device_type_str(device),
-            operation_type=OperationType.CREATE_BOUNTY,
-            operator=user['borrower_name'],
-            operation_time=datetime.now(),
-            borrower=user['borrower_name'],
-            reason=f'发布悬赏：{title}',
-            entry_source=EntrySource.USER.value
-        )
-        result = api_client._db.save_record(record)
+        save_user_record(device, user, OperationType.CREATE_BOUNTY, user['borrower_name'], f'发布悬赏：{title}')
 
         # 添加操作日志
         api_client._db.add_operation_log(
@@ -4871,12 +4395,11 @@ def api_found_bounty(bounty_id):
 
     # 更新悬赏状态为已找到
     from common.models import BountyStatus
-    from datetime import datetime
 
     bounty.status = BountyStatus.FOUND
     bounty.claimer_id = user['user_id']
     bounty.claimer_name = user['borrower_name']
-    bounty.claim_time = datetime.now()
+    bounty.claim_time = g.now
     bounty.finder_description = finder_description
     api_client._db.save_bounty(bounty)
 
@@ -4910,14 +4433,12 @@ def api_confirm_bounty(bounty_id):
     if bounty.status.value != '已找到':
         return jsonify({'success': False, 'message': '该悬赏状态不正确'})
 
-    from common.models import BountyStatus, DeviceStatus, Record
-    from datetime import datetime
-    import uuid
+    from common.models import BountyStatus, DeviceStatus
 
     if confirmed:
         # 确认完成
         bounty.status = BountyStatus.COMPLETED
-        bounty.complete_time = datetime.now()
+        bounty.complete_time = g.now
         api_client._db.save_bounty(bounty)
 
         # 给找到人发放悬赏积分
@@ -4936,24 +4457,12 @@ def api_confirm_bounty(bounty_id):
                 device.status = DeviceStatus.BORROWED
                 device.borrower_id = bounty.publisher_id
                 device.borrower_name = bounty.publisher_name
-                device.loan_time = datetime.now()
+                device.loan_time = g.now
                 api_client._db.save_device(device)
 
                 # 创建悬赏完成记录
-                from common.models import OperationType
-                record = Record(
-                    id=str(uuid.uuid4()),
-                    device_id=device.id,
-                    device_name=device.name,
-                    device_type=get_device_type_str(device),
-                    operation_type=OperationType.COMPLETE_BOUNTY,
-                    operator=user['borrower_name'],
-                    operation_time=datetime.now(),
-                    borrower=bounty.publisher_name,
-                    reason=f'悬赏完成：{bounty.title}，获得设备',
-                    entry_source=EntrySource.USER.value
-                )
-                result = api_client._db.save_record(record)
+                save_user_record(device, user, OperationType.COMPLETE_BOUNTY, bounty.publisher_name,
+                                 f'悬赏完成：{bounty.title}，获得设备')
 
                 # 添加操作日志
                 api_client._db.add_operation_log(
@@ -5036,20 +4545,7 @@ def api_cancel_bounty(bounty_id):
         device = api_client._db.get_device_by_id(bounty.device_id)
         if device:
             # 添加设备借用记录
-            from common.models import Record, OperationType
-            record = Record(
-                id=str(uuid.uuid4()),
-                device_id=device.id,
-                device_name=device.name,
-                device_type=get_device_type_str(device),
-                operation_type=OperationType.CANCEL_BOUNTY,
-                operator=user['borrower_name'],
-                operation_time=datetime.now(),
-                borrower=user['borrower_name'],
-                reason=f'取消悬赏：{bounty.title}',
-                entry_source=EntrySource.USER.value
-            )
-            result = api_client._db.save_record(record)
+            save_user_record(device, user, OperationType.CANCEL_BOUNTY, user['borrower_name'], f'取消悬赏：{bounty.title}')
 
             # 添加操作日志
             api_client._db.add_operation_log(
@@ -5068,15 +4564,10 @@ def api_cancel_bounty(bounty_id):
 @login_required
 def pc_profile():
     """PC端个人资料页面"""
-    api_client.reload_data()
     user = get_current_user()
 
     # 获取完整用户信息（包含头像）
-    full_user = None
-    for u in api_client._users:
-        if u.id == user['user_id']:
-            full_user = u
-            break
+    full_user = api_client.get_user_by_id(user['user_id'])
 
     # 获取用户背包物品
     from common.models import ShopItemType
@@ -5184,7 +4675,6 @@ def api_upload_avatar():
 
     try:
         from PIL import Image
-        import io
 
         # 读取图片
         image = Image.open(file.stream)
@@ -5198,7 +4688,7 @@ def api_upload_avatar():
         image.thumbnail(max_size, Image.Resampling.LANCZOS)
 
         # 生成文件名
-        filename = f"avatar_{user['user_id']}_{int(datetime.now().timestamp())}.jpg"
+        filename = f"avatar_{user['user_id']}_{int(g.now.timestamp())}.jpg"
 
         # 确保上传目录存在
         upload_dir = os.path.join(app.root_path, 'static', 'uploads', 'avatars')
@@ -5212,11 +4702,10 @@ def api_upload_avatar():
         avatar_url = f"/static/uploads/avatars/{filename}"
 
         # 查找并更新用户
-        for u in api_client._users:
-            if u.id == user['user_id']:
-                u.avatar = avatar_url
-                api_client._db.save_user(u)
-                break
+        full_user = api_client.get_user_by_id(user['user_id'])
+        if full_user:
+            full_user.avatar = avatar_url
+            api_client._db.save_user(full_user)
 
         return jsonify({
             'success': True,
@@ -5240,11 +4729,10 @@ def api_update_avatar():
         return jsonify({'success': False, 'message': '头像URL不能为空'})
 
     # 查找并更新用户
-    for u in api_client._users:
-        if u.id == user['user_id']:
-            u.avatar = avatar_url
-            api_client._db.save_user(u)
-            break
+    full_user = api_client.get_user_by_id(user['user_id'])
+    if full_user:
+        full_user.avatar = avatar_url
+        api_client._db.save_user(full_user)
 
     return jsonify({
         'success': True,
@@ -5266,13 +4754,10 @@ def api_update_signature():
         return jsonify({'success': False, 'message': '签名长度不能超过100个字符'})
 
     # 查找并更新用户
-    full_user = None
-    for u in api_client._users:
-        if u.id == user['user_id']:
-            u.signature = signature
-            api_client._db.save_user(u)
-            full_user = u
-            break
+    full_user = api_client.get_user_by_id(user['user_id'])
+    if full_user:
+        full_user.signature = signature
+        api_client._db.save_user(full_user)
 
     if full_user:
         return jsonify({
@@ -5537,12 +5022,11 @@ def api_get_device_pending_reservations(device_id):
 def api_get_my_pending_reservations():
     """获取所有需要当前用户确认的预约（用于首页弹窗）"""
     user = get_current_user()
-    api_client.reload_data()
     
     pending_reservations = []
     
     # 获取所有设备
-    all_devices = api_client.get_all_devices()
+    all_devices = get_request_devices()
     
     for device in all_devices:
         # 检查用户是否是保管人
@@ -5566,7 +5050,7 @@ def api_get_my_pending_reservations():
                         'reserver_id': r.reserver_id,
                         'device_id': device.id,
                         'device_name': device.name,
-                        'device_type': get_device_type_str(device),
+                        'device_type': device.device_type_label,
                         'start_time': r.start_time.strftime('%Y-%m-%d %H:%M') if r.start_time else '',
                         'end_time': r.end_time.strftime('%Y-%m-%d %H:%M') if r.end_time else '',
                         'confirm_role': 'custodian'
@@ -5587,7 +5071,7 @@ def api_get_my_pending_reservations():
                         'reserver_id': r.reserver_id,
                         'device_id': device.id,
                         'device_name': device.name,
-                        'device_type': get_device_type_str(device),
+                        'device_type': device.device_type_label,
                         'start_time': r.start_time.strftime('%Y-%m-%d %H:%M') if r.start_time else '',
                         'end_time': r.end_time.strftime('%Y-%m-%d %H:%M') if r.end_time else '',
                         'confirm_role': 'borrower'
@@ -5603,7 +5087,6 @@ def api_get_my_pending_reservations():
 @login_required
 def pc_my_reservations():
     """我的预约列表页面"""
-    api_client.reload_data()
     user = get_current_user()
     
     # 获取用户的所有预约
@@ -5624,20 +5107,22 @@ def pc_my_reservations():
 
 @app.route('/api/transfer', methods=['POST'])
 @login_required
+@device_locked
 def api_transfer():
     """转借设备API（支持强制转借）"""
     user = get_current_user()
     data = request.json
     
-    # 重新加载数据以获取最新状态
-    api_client.reload_data()
-    
     device_id = data.get('device_id')
     device_type = data.get('device_type')
     transfer_to = data.get('transfer_to')
     remark = data.get('remark', '')
     force = data.get('force', False)  # 是否强制转借
     
+    # 检查不能转借给自己
+    if transfer_to == user['borrower_name']:
+        return jsonify({'success': False, 'message': '不能转借给自己'})
+    
     device = api_client.get_device_by_id(device_id)
     if not device:
         return jsonify({'success': False, 'message': '设备不存在'})
@@ -5654,11 +5139,7 @@ def api_transfer():
         return jsonify({'success': False, 'message': '设备状态异常'})
     
     # 检查转借对象是否存在
-    target_user = None
-    for u in api_client._users:
-        if u.borrower_name == transfer_to:
-            target_user = u
-            break
+    target_user = api_client.get_user_by_borrower_name(transfer_to)
     
     if not target_user:
         return jsonify({'success': False, 'message': '转借对象不存在'})
@@ -5666,16 +5147,8 @@ def api_transfer():
     if target_user.is_frozen:
         return jsonify({'success': False, 'message': '转借对象账号已被冻结'})
     
-    # 检查不能转借给自己
-    if transfer_to == user['borrower_name']:
-        return jsonify({'success': False, 'message': '不能转借给自己'})
-    
     # 检查转借对象借用数量限制
-    user_borrowed_count = 0
-    all_devices = api_client.get_all_devices()
-    for d in all_devices:
-        if d.borrower == transfer_to and d.status == DeviceStatus.BORROWED:
-            user_borrowed_count += 1
+    user_borrowed_count = api_client.count_borrowed_devices(transfer_to)
     
     borrow_limit = 10
     if user_borrowed_count >= borrow_limit:
@@ -5711,38 +5184,22 @@ def api_transfer():
     original_borrower = device.borrower
     
     # 更新设备信息
-    device.borrower = transfer_to
-    device.phone = ''  # 转借时清空手机号，由接收人自行填写
-    device.previous_borrower = original_borrower
-    device.status = DeviceStatus.BORROWED
-    device.lost_time = None  # 清除丢失时间
-    device.entry_source = EntrySource.USER.value
-    device.expected_return_date = datetime.now() + timedelta(days=1)  # 转借后预计归还时间刷新为当前时间+1天
-    
-    api_client.update_device(device, source="user")
+    with api_client.device_txn(device, source="user"):
+        device.borrower = transfer_to
+        device.phone = ''  # 转借时清空手机号，由接收人自行填写
+        device.previous_borrower = original_borrower
+        device.status = DeviceStatus.BORROWED
+        device.lost_time = None  # 清除丢失时间
+        device.entry_source = EntrySource.USER.value
+        device.expected_return_date = g.now + timedelta(days=1)  # 转借后预计归还时间刷新为当前时间+1天
     
     # 添加记录
-    record = Record(
-        id=str(uuid.uuid4()),
-        device_id=device.id,
-        device_name=device.name,
-        device_type=get_device_type_str(device),
-        operation_type=OperationType.TRANSFER,
-        operator=user['borrower_name'],
-        operation_time=datetime.now(),
-        borrower=f"被转借：{original_borrower or '保管人'}——>{transfer_to}",
-        phone='',
-        reason=remark or '用户转借',
-        entry_source=EntrySource.USER.value
-    )
-    api_client._db.save_record(record)
+    save_user_record(device, user, OperationType.TRANSFER,
+                     f"被转借：{original_borrower or '保管人'}——>{transfer_to}", remark or '用户转借')
     
     # 给转借对象增加借用次数
-    for u in api_client._users:
-        if u.borrower_name == transfer_to:
-            u.borrow_count += 1
-            api_client._db.save_user(u)
-            break
+    target_user.borrow_count += 1
+    api_client._db.save_user(target_user)
     
     api_client.add_operation_log(f"转借设备 {original_borrower or '保管人'} -> {transfer_to}", device.name, operator=user['borrower_name'], source="user")
     
@@ -5759,11 +5216,7 @@ def api_transfer():
     
     # 通知原借用人（如果存在且不是当前用户）
     if original_borrower and original_borrower != user['borrower_name']:
-        original_user = None
-        for u in api_client._users:
-            if u.borrower_name == original_borrower:
-                original_user = u
-                break
+        original_user = api_client.get_user_by_borrower_name(original_borrower)
         if original_user:
             api_client.add_notification(
                 user_id=original_user.id,
@@ -5777,11 +5230,7 @@ def api_transfer():
     
     # 通知保管人（如果存在且不是相关人）
     if device.cabinet_number and device.cabinet_number != original_borrower and device.cabinet_number != user['borrower_name']:
-        custodian_user = None
-        for u in api_client._users:
-            if u.borrower_name == device.cabinet_number:
-                custodian_user = u
-                break
+        custodian_user = api_client.get_user_by_borrower_name(device.cabinet_number)
         if custodian_user:
             api_client.add_notification(
                 user_id=custodian_user.id,
@@ -5865,11 +5314,7 @@ def auto_deduct_overdue_points_job():
                     time_diff = now - device.expected_return_date
                     # 只要过了预期归还时间就算逾期
                     # 查找借用人
-                    borrower_user = None
-                    for u in api_client._users:
-                        if u.borrower_name == device.borrower:
-                            borrower_user = u
-                            break
+                    borrower_user = api_client.get_user_by_borrower_name(device.borrower)
 
                     if borrower_user:
                         # 检查今天是否已经扣除过该设备的逾期积分
@@ -5980,7 +5425,7 @@ def api_borrow_return_stats():
             borrow_data = [0] * 24
             return_data = [0] * 24
             
-            today = datetime.now().strftime('%Y-%m-%d')
+            today = g.now.strftime('%Y-%m-%d')
             
             for record in all_records:
                 try:
@@ -6007,7 +5452,7 @@ def api_borrow_return_stats():
         
         elif range_type == 'month':
             # 按天统计本月数据
-            now = datetime.now()
+            now = g.now
             year = now.year
             month = now.month
             
@@ -6042,7 +5487,7 @@ def api_borrow_return_stats():
         
         elif range_type == 'year':
             # 按月份统计本年数据
-            now = datetime.now()
+            now = g.now
             year = now.year
             
             labels = ['1月', '2月', '3月', '4月', '5月', '6月', '7月', '8月', '9月', '10月', '11月', '12月']
@@ -6093,6 +5538,12 @@ def internal_error(error):
     return render_template('error.html', message='服务器内部错误'), 500
 
 
+@app.errorhandler(DeviceDeletedError)
+def device_deleted(error):
+    """device_txn 写回时设备已被删除（如管理端同时删除了该设备）"""
+    return jsonify({'success': False, 'message': '设备不存在'})
+
+
 # ========== 设备图片和附件API ==========
 
 # 上传目录
@@ -6104,42 +5555,17 @@ ATTACHMENT_FOLDER = os.path.join(UPLOAD_FOLDER, 'attachments')
 os.makedirs(IMAGE_FOLDER, exist_ok=True)
 os.makedirs(ATTACHMENT_FOLDER, exist_ok=True)
 
-# 存储图片和附件数据（使用JSON文件存储）
+# 存储图片和附件数据（JSON快照 + 追加写的修改日志，见 DeviceMediaStore）
 DEVICE_MEDIA_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'device_media.json')
-os.makedirs(os.path.dirname(DEVICE_MEDIA_FILE), exist_ok=True)
-
-def load_device_media():
-    """加载设备媒体数据"""
-    if os.path.exists(DEVICE_MEDIA_FILE):
-        try:
-            with open(DEVICE_MEDIA_FILE, 'r', encoding='utf-8') as f:
-                content = f.read().strip()
-                if content:
-                    return json.loads(content)
-        except (json.JSONDecodeError, IOError):
-            pass
-    return {'images': {}, 'attachments': {}}
-
-def save_device_media(data):
-    """保存设备媒体数据"""
-    with open(DEVICE_MEDIA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+device_media_store = DeviceMediaStore(DEVICE_MEDIA_FILE)
 
 def get_device_images(device_id):
-    """获取设备的图片列表"""
-    media = load_device_media()
-    images = media.get('images', {}).get(device_id, [])
-    # 按上传时间倒序排列
-    images.sort(key=lambda x: x.get('upload_time', ''), reverse=True)
-    return images
+    """获取设备的图片列表（按上传时间倒序）"""
+    return device_media_store.get_items('images', device_id)
 
 def get_device_attachments(device_id):
-    """获取设备的附件列表"""
-    media = load_device_media()
-    attachments = media.get('attachments', {}).get(device_id, [])
-    # 按上传时间倒序排列
-    attachments.sort(key=lambda x: x.get('upload_time', ''), reverse=True)
-    return attachments
+    """获取设备的附件列表（按上传时间倒序）"""
+    return device_media_store.get_items('attachments', device_id)
 
 @app.route('/api/device/images/upload', methods=['POST'])
 @login_required
@@ -6163,12 +5589,6 @@ def api_upload_device_images():
     
     max_size = 200 * 1024 * 1024  # 200MB
     uploaded = []
-    media = load_device_media()
-    
-    if 'images' not in media:
-        media['images'] = {}
-    if device_id not in media['images']:
-        media['images'][device_id] = []
     
     for file in files:
         if file.filename == '':
@@ -6205,13 +5625,12 @@ def api_upload_device_images():
             'device_type': device_type,
             'filename': file.filename,
             'url': url,
-            'upload_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'upload_time': g.now.strftime('%Y-%m-%d %H:%M:%S'),
             'uploader': user['borrower_name']
         }
-        media['images'][device_id].append(image_data)
         uploaded.append(image_data)
     
-    save_device_media(media)
+    device_media_store.add_items('images', device_id, uploaded)
     
     return jsonify({
         'success': True,
@@ -6230,15 +5649,8 @@ def api_delete_device_image(image_id):
     if not device_id:
         return jsonify({'success': False, 'message': '设备ID不能为空'})
     
-    media = load_device_media()
-    images = media.get('images', {}).get(device_id, [])
-    
     # 查找图片
-    image = None
-    for img in images:
-        if img['id'] == image_id:
-            image = img
-            break
+    image = device_media_store.find_item('images', device_id, image_id)
     
     if not image:
         return jsonify({'success': False, 'message': '图片不存在'})
@@ -6257,8 +5669,7 @@ def api_delete_device_image(image_id):
         print(f"删除图片文件失败: {e}")
     
     # 从记录中移除
-    media['images'][device_id] = [img for img in images if img['id'] != image_id]
-    save_device_media(media)
+    device_media_store.remove_item('images', device_id, image_id)
     
     return jsonify({'success': True, 'message': '删除成功'})
 
@@ -6284,12 +5695,6 @@ def api_upload_device_attachments():
     
     max_size = 200 * 1024 * 1024  # 200MB
     uploaded = []
-    media = load_device_media()
-    
-    if 'attachments' not in media:
-        media['attachments'] = {}
-    if device_id not in media['attachments']:
-        media['attachments'][device_id] = []
     
     for file in files:
         if file.filename == '':
@@ -6324,13 +5729,12 @@ def api_upload_device_attachments():
             'filename': file.filename,
             'url': url,
             'size': size,
-            'upload_time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'upload_time': g.now.strftime('%Y-%m-%d %H:%M:%S'),
             'uploader': user['borrower_name']
         }
-        media['attachments'][device_id].append(attachment_data)
         uploaded.append(attachment_data)
     
-    save_device_media(media)
+    device_media_store.add_items('attachments', device_id, uploaded)
     
     return jsonify({
         'success': True,
@@ -6349,15 +5753,8 @@ def api_delete_device_attachment(attachment_id):
     if not device_id:
         return jsonify({'success': False, 'message': '设备ID不能为空'})
     
-    media = load_device_media()
-    attachments = media.get('attachments', {}).get(device_id, [])
-    
     # 查找附件
-    attachment = None
-    for att in attachments:
-        if att['id'] == attachment_id:
-            attachment = att
-            break
+    attachment = device_media_store.find_item('attachments', device_id, attachment_id)
     
     if not attachment:
         return jsonify({'success': False, 'message': '附件不存在'})
@@ -6376,8 +5773,7 @@ def api_delete_device_attachment(attachment_id):
         print(f"删除附件文件失败: {e}")
     
     # 从记录中移除
-    media['attachments'][device_id] = [att for att in attachments if att['id'] != attachment_id]
-    save_device_media(media)
+    device_media_store.remove_item('attachments', device_id, attachment_id)
     
     return jsonify({'success': True, 'message': '删除成功'})
 
@@ -6395,8 +5791,7 @@ def api_batch_download_attachments():
     if not device_id or not attachment_ids:
         return jsonify({'success': False, 'message': '参数错误'}), 400
     
-    media = load_device_media()
-    attachments = media.get('attachments', {}).get(device_id, [])
+    attachments = device_media_store.get_items('attachments', device_id)
     
     # 筛选要下载的附件
     selected_attachments = []
@@ -6422,7 +5817,7 @@ def api_batch_download_attachments():
         memory_file,
         mimetype='application/zip',
         as_attachment=True,
-        download_name=f'attachments_{device_id}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip'
+        download_name=f'attachments_{device_id}_{g.now.strftime("%Y%m%d_%H%M%S")}.zip'
     )
 
 # 静态文件服务 - 上传的文件
@@ -6477,8 +5872,20 @@ def api_wheel_hidden_titles():
 if __name__ == '__main__':
     print(f"用户服务启动在端口 {USER_SERVICE_PORT}")
     try:
-        # threaded=True 启用多线程支持高并发
-        app.run(debug=False, host='0.0.0.0', port=USER_SERVICE_PORT, threaded=True)
+        try:
+            from waitress import serve
+        except ImportError:
+            serve = None
+        if serve:
+            # 生产环境使用 Waitress 多线程 WSGI 服务器；定时任务在导入时启动，
+            # 因此保持单进程多线程，不使用多 worker 进程（否则每个进程都会重复执行定时任务）
+            threads = USER_SERVICE_THREADS
+            print(f"使用 Waitress 启动，线程数: {threads}")
+            serve(app, host='0.0.0.0', port=USER_SERVICE_PORT, threads=threads)
+        else:
+            # 未安装 Waitress 时降级到 Flask 开发服务器，threaded=True 启用多线程
+            print("[警告] Waitress未安装，使用Flask开发服务器，建议安装: pip install waitress")
+            app.run(debug=False, host='0.0.0.0', port=USER_SERVICE_PORT, threaded=True)
     finally:
         # 关闭定时任务
         if scheduler: